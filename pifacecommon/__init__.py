@@ -14,3 +14,13 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+
+
+def __getattr__(name):
+    # pifacecommon.interrupts is no longer imported by pifacecommon.mcp23s17
+    # so it is imported the first time it is used (Python 3.7+)
+    if name == 'interrupts':
+        import importlib
+        return importlib.import_module('.interrupts', __name__)
+    raise AttributeError(
+        "module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,148 @@
+import threading
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from .mcp23s17 import READ_CMD, WRITE_CMD
+from .spi import MAX_TRANSFERS
+
+
+READ, WRITE, UPDATE = range(3)
+
+# one I/O thread per SPI device, keyed by (bus, chip_select)
+_threads = dict()
+_threads_lock = threading.Lock()
+
+
+class BusRequest(object):
+    """A register operation waiting for the I/O thread."""
+    def __init__(self, kind, chip, address, argument):
+        self.kind = kind
+        self.chip = chip
+        self.address = address
+        # data for WRITE, value -> value function for READ/UPDATE
+        self.argument = argument
+        self.future = Future()
+
+
+class BusIOThread(object):
+    """Serves register operations for every chip on one SPI device from a
+    single thread. Whatever requests are queued when the thread wakes up, up
+    to the most transfers an ioctl can carry, are sent together in one ioctl
+    and then their futures are resolved. The rest wait for the next ioctl.
+    """
+    def __init__(self, device):
+        """
+        :param device: Any SPI device on the bus, used to send messages.
+        :type device: :class:`pifacecommon.spi.SPIDevice`
+        """
+        self.device = device
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, kind, chip, address, argument=None):
+        """Queues a register operation.
+
+        :returns: :py:class:`concurrent.futures.Future`
+        """
+        request = BusRequest(kind, chip, address, argument)
+        self.requests.put(request)
+        return request.future
+
+    def _run(self):
+        while True:
+            batch = list()
+            request = self.requests.get()
+            # each request is one transfer of an ioctl (an UPDATE's write
+            # starts the next one), so this keeps every ioctl within limits
+            while True:
+                # requests cancelled while queued (e.g. by asyncio.wait_for)
+                # are dropped, the rest can't be cancelled any more
+                if request.future.set_running_or_notify_cancel():
+                    batch.append(request)
+                if len(batch) == MAX_TRANSFERS:
+                    break
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            try:
+                self._serve(batch)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+
+    def _serve(self, batch):
+        # Requests are sent in order. An UPDATE can only build its write
+        # once its read has come back, so the messages so far are sent at
+        # that point and the write leads the next ioctl.
+        pending = list()  # (future or None, message, reply -> result)
+        for request in batch:
+            if request.kind == WRITE:
+                pending.append((
+                    request.future,
+                    _message(request.chip, WRITE_CMD, request.address,
+                             request.argument),
+                    _no_result))
+            elif request.kind == READ:
+                pending.append((
+                    request.future,
+                    _message(request.chip, READ_CMD, request.address, 0),
+                    _read_result(request.argument)))
+            else:
+                pending.append((
+                    None,
+                    _message(request.chip, READ_CMD, request.address, 0),
+                    None))
+                replies = self._send(pending)
+                new_value = request.argument(bytearray(replies[-1])[2])
+                pending = [(
+                    request.future,
+                    _message(request.chip, WRITE_CMD, request.address,
+                             new_value),
+                    lambda reply, new_value=new_value: new_value)]
+        self._send(pending)
+
+    def _send(self, pending):
+        replies = self.device.spisend_many(
+            [message for future, message, result in pending])
+        for (future, message, result), reply in zip(pending, replies):
+            if future is not None and not future.done():
+                future.set_result(result(reply))
+        return replies
+
+
+def _no_result(reply):
+    return None
+
+
+def _read_result(transform):
+    def result(reply):
+        value = bytearray(reply)[2]
+        return value if transform is None else transform(value)
+    return result
+
+
+def _message(chip, read_write_cmd, address, data):
+    ctrl_byte = chip._get_spi_control_byte(read_write_cmd)
+    return bytes(bytearray((ctrl_byte, address, data)))
+
+
+def get_bus_io_thread(chip):
+    """Returns the I/O thread for the chip's SPI device, starting it if
+    needed.
+
+    :param chip: The chip.
+    :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+    """
+    key = (chip.bus, chip.chip_select)
+    with _threads_lock:
+        if key not in _threads:
+            _threads[key] = BusIOThread(chip)
+        return _threads[key]
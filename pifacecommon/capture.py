@@ -0,0 +1,231 @@
+import sys
+import time
+import struct
+import itertools
+import threading
+from collections import namedtuple, deque
+from .core import monotonic
+
+
+MAGIC = b'PFCAP\x01'
+# batch number, monotonic timestamp, bus, chip select, speed, transfers
+RECORD_HEADER = struct.Struct('<IdBBIH')
+DEFAULT_CAPACITY = 4096  # batches
+DRAIN_INTERVAL = 0.05
+
+
+CaptureRecord = namedtuple(
+    'CaptureRecord',
+    ['batch', 'timestamp', 'bus', 'chip_select', 'speed_hz', 'transfers'])
+CaptureRecord.__doc__ = """One ioctl. transfers is a list of (tx, rx) bytes,
+one pair for each chip select assertion."""
+
+
+class SPICapture(object):
+    """Records every transfer of the devices it is attached to (see
+    :meth:`pifacecommon.spi.SPIDevice.enable_capture`) into a binary log.
+
+    Each batch (ioctl) is appended to a bounded deque without taking a lock
+    and a background thread drains it into the file. Appending and taking
+    batch numbers are atomic, so any number of threads can record at once
+    (e.g. the busio I/O thread, MultiBusExecutor workers and the PWM
+    scheduler). If the writer falls behind the batch is dropped and counted
+    in :attr:`dropped`; batch numbers are taken before the check so drops
+    show up as gaps in the log.
+
+    >>> capture = pifacecommon.capture.SPICapture('/tmp/bus.cap')
+    >>> chip = pifacecommon.mcp23s17.MCP23S17()
+    >>> chip.enable_capture(capture)  # doctest: +ELLIPSIS
+    <pifacecommon.capture.SPICapture object at ...>
+    >>> chip.gpioa.value = 0xAA
+    >>> capture.close()
+    >>> pifacecommon.capture.replay('/tmp/bus.cap')['mismatches']
+    []
+    """
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        """
+        :param path: The file to write the log to.
+        :type path: str
+        :param capacity: The number of batches the ring can hold.
+        :type capacity: int
+        """
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.capacity = capacity
+        self.ring = deque()
+        self.dropped = 0
+        self._batch_numbers = itertools.count()
+        self._dropped_lock = threading.Lock()
+        self._closing = threading.Event()
+        self.thread = threading.Thread(target=self._drain_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, device, lengths, tx, rx, speed_hz, timestamp):
+        """Puts an ioctl on the ring. Called by the SPI device.
+
+        :param device: The device that sent the messages.
+        :type device: :class:`pifacecommon.spi.SPIDevice`
+        :param lengths: The length of each message.
+        :type lengths: list
+        :param tx: The messages sent, laid end to end.
+        :type tx: bytes
+        :param rx: The replies, laid end to end.
+        :type rx: bytes
+        :param speed_hz: The SPI clock speed.
+        :type speed_hz: int
+        :param timestamp: When the ioctl started
+            (:func:`pifacecommon.core.monotonic`).
+        :type timestamp: float
+        """
+        batch = next(self._batch_numbers)
+        # producers racing here can overfill the ring by a few batches
+        if len(self.ring) >= self.capacity:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        self.ring.append((
+            batch, timestamp, device.bus, device.chip_select, speed_hz,
+            lengths, tx, rx))
+
+    def close(self):
+        """Writes out the rest of the ring and closes the file."""
+        self._closing.set()
+        self.thread.join()
+        self.file.close()
+
+    def _drain_forever(self):
+        while not self._closing.wait(DRAIN_INTERVAL):
+            self._drain()
+        self._drain()
+
+    def _drain(self):
+        if not self.ring:
+            return
+        while True:
+            try:
+                (batch, timestamp, bus, chip_select, speed_hz,
+                 lengths, tx, rx) = self.ring.popleft()
+            except IndexError:
+                break
+            self.file.write(RECORD_HEADER.pack(
+                batch & 0xFFFFFFFF, timestamp, bus, chip_select, speed_hz,
+                len(lengths)))
+            self.file.write(struct.pack('<%dH' % len(lengths), *lengths))
+            self.file.write(tx)
+            self.file.write(rx)
+        self.file.flush()
+
+
+def read_capture(path):
+    """Reads a capture log.
+
+    :param path: The log file.
+    :type path: str
+    :returns: generator of :class:`CaptureRecord`
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not an SPI capture" % path)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return  # end of the log (or a record cut short)
+            (batch, timestamp, bus, chip_select, speed_hz,
+             count) = RECORD_HEADER.unpack(header)
+            lengths = struct.unpack('<%dH' % count, f.read(2 * count))
+            tx = f.read(sum(lengths))
+            rx = f.read(sum(lengths))
+            transfers = list()
+            offset = 0
+            for length in lengths:
+                transfers.append((tx[offset:offset+length],
+                                  rx[offset:offset+length]))
+                offset += length
+            yield CaptureRecord(
+                batch, timestamp, bus, chip_select, speed_hz, transfers)
+
+
+def replay(path, models=None, realtime=False):
+    """Replays a capture log against software MCP23S17s and reports on it.
+
+    Replies from the models are compared to the captured ones. Reads of
+    input pins will only match if the models' inputs are driven to match
+    (see :meth:`pifacecommon.emulator.MCP23S17Model.set_inputs`).
+
+    :param path: The log file.
+    :type path: str
+    :param models: :class:`pifacecommon.emulator.MCP23S17Model` keyed by
+        (bus, chip_select). Missing ones are created with a single chip at
+        hardware address 0.
+    :type models: dict
+    :param realtime: Sleep to keep the captured gaps between batches.
+    :type realtime: bool
+    :returns: dict -- batches, transfers, bytes, dropped_batches,
+        duration, busy_time (bus time at the captured speeds),
+        bytes_per_second, max_gap and mismatches (batch, transfer index,
+        captured rx, model rx).
+    """
+    from .emulator import MCP23S17Model
+    if models is None:
+        models = dict()
+    report = {'batches': 0, 'transfers': 0, 'bytes': 0,
+              'dropped_batches': 0, 'duration': 0.0, 'busy_time': 0.0,
+              'bytes_per_second': 0.0, 'max_gap': 0.0, 'mismatches': []}
+    first = previous = None
+    # batches from several threads can be out of order
+    lowest_batch = highest_batch = None
+    replay_start = monotonic()
+    for record in read_capture(path):
+        if previous is None:
+            first = record
+        else:
+            report['max_gap'] = max(report['max_gap'],
+                                    record.timestamp - previous.timestamp)
+        previous = record
+        if lowest_batch is None:
+            lowest_batch = highest_batch = record.batch
+        else:
+            lowest_batch = min(lowest_batch, record.batch)
+            highest_batch = max(highest_batch, record.batch)
+
+        if realtime:
+            delay = (record.timestamp - first.timestamp) - \
+                (monotonic() - replay_start)
+            if delay > 0:
+                time.sleep(delay)
+
+        key = (record.bus, record.chip_select)
+        if key not in models:
+            models[key] = MCP23S17Model()
+        model = models[key]
+        for i, (tx, rx) in enumerate(record.transfers):
+            model_rx = model.transfer(tx)
+            if model_rx != rx:
+                report['mismatches'].append((record.batch, i, rx, model_rx))
+            report['bytes'] += len(tx)
+            report['busy_time'] += len(tx) * 8.0 / record.speed_hz
+        report['batches'] += 1
+        report['transfers'] += len(record.transfers)
+
+    if previous is not None:
+        report['dropped_batches'] = \
+            highest_batch - lowest_batch + 1 - report['batches']
+        report['duration'] = previous.timestamp - first.timestamp
+    if report['duration'] > 0:
+        report['bytes_per_second'] = report['bytes'] / report['duration']
+    return report
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m pifacecommon.capture <capture file> "
+                 "[--realtime]")
+    report = replay(sys.argv[1], realtime='--realtime' in sys.argv[2:])
+    mismatches = report.pop('mismatches')
+    for name in sorted(report):
+        print("%-17s %s" % (name + ':', report[name]))
+    print("%-17s %d" % ('mismatches:', len(mismatches)))
+    for batch, i, rx, model_rx in mismatches:
+        print("  batch %d transfer %d: captured %r, model %r"
+              % (batch, i, rx, model_rx))
@@ -0,0 +1,122 @@
+import time
+import collections
+from .core import get_bit_mask
+from .mcp23s17 import GPIOA, GPIOB, read_ports
+
+
+PortChange = collections.namedtuple(
+    'PortChange', ['chip', 'port', 'changed_mask', 'new_value', 'timestamp'])
+PortChange.__doc__ = """Some pins on a port have changed."""
+
+PinChange = collections.namedtuple(
+    'PinChange', ['chip', 'port', 'pin_num', 'value', 'timestamp'])
+PinChange.__doc__ = """A single pin has changed."""
+
+
+class ChangeFeed(object):
+    """Turns port reads from any number of chips into a stream of changes.
+    The last value of each (chip, port) is kept and each new value is XORed
+    against it so that records are only produced when something changed.
+    Values can come from polling (:meth:`poll`) or from interrupts
+    (:meth:`update_from_event`).
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=i)
+    ...          for i in range(4)]
+    >>> feed = pifacecommon.changefeed.ChangeFeed()
+    >>> for change in feed.watch(chips, interval=0.01):
+    ...     print(change.chip.hardware_addr, bin(change.changed_mask))
+    """
+    def __init__(self):
+        self.snapshots = dict()  # (chip, port) -> last value
+
+    def update(self, chip, port, value, timestamp=None):
+        """Stores a new port value. Returns a :class:`PortChange` if it is
+        different from the last one, otherwise None. The first value seen
+        for a port is stored without producing a change.
+
+        :param chip: The chip the value came from.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param port: The port (GPIOA/GPIOB).
+        :type port: int
+        :param value: The new port value.
+        :type value: int
+        :param timestamp: When the value was read (default: now).
+        :type timestamp: float
+        """
+        key = (chip, port)
+        old_value = self.snapshots.get(key)
+        self.snapshots[key] = value
+        if old_value is None or old_value == value:
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        return PortChange(chip, port, old_value ^ value, value, timestamp)
+
+    def update_from_event(self, event, port):
+        """Stores the captured port value of an
+        :class:`pifacecommon.interrupts.InterruptEvent`.
+
+        :param event: The interrupt event.
+        :type event: :class:`pifacecommon.interrupts.InterruptEvent`
+        :param port: The port the event came from (GPIOA/GPIOB).
+        :type port: int
+        :returns: :class:`PortChange` or None
+        """
+        return self.update(
+            event.chip, port, event.interrupt_capture, event.timestamp)
+
+    def poll(self, chips, ports=(GPIOA, GPIOB)):
+        """Reads both ports of every chip in one batch and returns the
+        list of changes.
+
+        :param chips: The chips to read.
+        :type chips: list
+        :param ports: The ports to report changes on.
+        :type ports: tuple
+        :returns: list -- :class:`PortChange` records
+        """
+        port_values = read_ports(chips, GPIOA)
+        timestamp = time.time()
+        changes = list()
+        for chip, (value_a, value_b) in zip(chips, port_values):
+            for port, value in ((GPIOA, value_a), (GPIOB, value_b)):
+                if port not in ports:
+                    continue
+                change = self.update(chip, port, value, timestamp)
+                if change is not None:
+                    changes.append(change)
+        return changes
+
+    def watch(self, chips, interval, ports=(GPIOA, GPIOB)):
+        """Polls the chips forever, yielding each change.
+
+        :param chips: The chips to read.
+        :type chips: list
+        :param interval: Seconds between polls.
+        :type interval: float
+        :param ports: The ports to report changes on.
+        :type ports: tuple
+        """
+        while True:
+            for change in self.poll(chips, ports):
+                yield change
+            time.sleep(interval)
+
+
+def expand(changes):
+    """Yields a :class:`PinChange` for every pin in each
+    :class:`PortChange`.
+
+    :param changes: The port changes.
+    :type changes: iterable
+    """
+    for change in changes:
+        for pin_num in range(8):
+            bit_mask = get_bit_mask(pin_num)
+            if change.changed_mask & bit_mask:
+                yield PinChange(
+                    change.chip,
+                    change.port,
+                    pin_num,
+                    1 if change.new_value & bit_mask else 0,
+                    change.timestamp)
@@ -0,0 +1,101 @@
+import threading
+from .core import monotonic
+from .mcp23s17 import INTFA, INTFB, INTCAPA, INTCAPB, GPIOA, GPIOB
+
+
+# registers whose value can change without being written
+VOLATILE_REGISTERS = (INTFA, INTFB, INTCAPA, INTCAPB, GPIOA, GPIOB)
+# registers whose read clears the interrupt, never served from the cache
+INTERRUPT_CLEARING_REGISTERS = (INTCAPA, INTCAPB, GPIOA, GPIOB)
+
+
+class PendingRead(object):
+    """A read in flight that other readers of the address wait for."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadCoalescer(object):
+    """Shares register reads between threads. A read of an address that is
+    already being read waits for that transfer instead of sending its own,
+    and with a max_staleness every read of the address within that many
+    seconds of the start of the last transfer gets its value (e.g. a burst
+    of bits[i].value reads on one register). Any write, or read of a
+    register that clears the interrupt, forgets the cached values.
+
+    Reads of INTCAP and GPIO clear the interrupt, so they are only shared
+    while in flight and never served from the cache.
+
+    >>> chip = pifacecommon.mcp23s17.MCP23S17()
+    >>> coalescer = chip.enable_read_coalescing(max_staleness=0.001)
+    >>> [bit.value for bit in chip.intfb.bits]  # one SPI transfer
+    [0, 0, 0, 0, 0, 0, 0, 0]
+    """
+    def __init__(self, read, max_staleness=0, addresses=VOLATILE_REGISTERS):
+        """
+        :param read: Reads an address from the chip.
+        :type read: function
+        :param max_staleness: Seconds a value can be reused for (0 only
+            shares reads in flight).
+        :type max_staleness: float
+        :param addresses: The addresses to coalesce reads of.
+        :type addresses: list
+        """
+        self._read = read
+        self.max_staleness = max_staleness
+        self.addresses = frozenset(addresses)
+        self.in_flight = dict()  # address -> PendingRead
+        self.values = dict()  # address -> (value, time the read started)
+        self.generation = 0  # changed by every invalidate
+        self._lock = threading.Lock()
+
+    def read(self, address):
+        """Returns the value of the address, sharing a transfer with other
+        readers where possible.
+        """
+        clears_interrupt = address in INTERRUPT_CLEARING_REGISTERS
+        with self._lock:
+            if self.max_staleness and not clears_interrupt:
+                cached = self.values.get(address)
+                if cached is not None and \
+                        monotonic() - cached[1] <= self.max_staleness:
+                    return cached[0]
+            pending = self.in_flight.get(address)
+            owner = pending is None
+            if owner:
+                pending = self.in_flight[address] = PendingRead()
+                generation = self.generation
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        start_time = monotonic()
+        try:
+            pending.value = self._read(address)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self.in_flight[address]
+                if clears_interrupt:
+                    # INTF may have been cleared
+                    self.values = dict()
+                    self.generation += 1
+                # don't cache a value read before a write
+                elif pending.error is None and self.max_staleness and \
+                        generation == self.generation:
+                    self.values[address] = (pending.value, start_time)
+            pending.done.set()
+        return pending.value
+
+    def invalidate(self):
+        """Forgets the cached values."""
+        with self._lock:
+            self.values = dict()
+            self.generation += 1
@@ -1,3 +1,12 @@
+import time
+
+
+try:
+    monotonic = time.monotonic
+except AttributeError:  # Python 2
+    monotonic = time.time
+
+
 def get_bit_mask(bit_num):
     """Returns as bit mask with bit_num set.
 
@@ -16,6 +25,22 @@ def get_bit_mask(bit_num):
     return 1 << (bit_num)
 
 
+def _numpy():
+    """Returns the numpy module, or None if it is not installed. It is only
+    imported when first needed since it is slow to import.
+    """
+    global _numpy_module
+    if _numpy_module is False:
+        try:
+            import numpy
+            _numpy_module = numpy
+        except ImportError:
+            _numpy_module = None
+    return _numpy_module
+
+_numpy_module = False  # not imported yet
+
+
 def get_bit_num(bit_pattern):
     """Returns the lowest bit num from a given bit pattern. Returns None if no
     bits set.
@@ -55,3 +80,55 @@ def sleep_microseconds(microseconds):
     # divide microseconds by 1 million for seconds
     seconds = microseconds / float(1000000)
     time.sleep(seconds)
+
+
+def unpack_pins(port_values):
+    """Returns the 16 pin values of each board from its A and B port values.
+    Pin 0 is bit 0 of port A and pin 15 is bit 7 of port B. If NumPy is
+    available then an (n_boards, 16) boolean array is returned, otherwise a
+    list of lists of 16 bools.
+
+    :param port_values: (port A, port B) values of each board.
+    :type port_values: list
+    :returns: the pin values of each board
+
+    >>> pifacecommon.core.unpack_pins([(0b1, 0b10000000)])
+    array([[ True, False, False, False, False, False, False, False, False,
+            False, False, False, False, False, False,  True]])
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        ports = numpy.asarray(port_values, dtype=numpy.uint8).reshape(-1, 2)
+        return numpy.unpackbits(
+            ports, axis=1, bitorder='little').astype(bool)
+
+    return [[bool((port_a | (port_b << 8)) & get_bit_mask(i))
+             for i in range(16)]
+            for port_a, port_b in port_values]
+
+
+def pack_pins(pins):
+    """Returns the (port A, port B) values of each board from its 16 pin
+    values. This is the inverse of :func:`unpack_pins`.
+
+    :param pins: The pin values of each board, shape (n_boards, 16).
+    :type pins: :py:class:`numpy.ndarray` or list
+    :returns: list -- (port A, port B) tuples
+
+    >>> pifacecommon.core.pack_pins([[1] + [0]*14 + [1]])
+    [(1, 128)]
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        pins = numpy.asarray(pins, dtype=bool).reshape(-1, 16)
+        ports = numpy.packbits(pins, axis=1, bitorder='little')
+        return [(int(port_a), int(port_b)) for port_a, port_b in ports]
+
+    packed = list()
+    for board_pins in pins:
+        value = 0
+        for i, pin in enumerate(board_pins):
+            if pin:
+                value |= get_bit_mask(i)
+        packed.append((value & 0xFF, value >> 8))
+    return packed
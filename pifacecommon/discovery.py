@@ -0,0 +1,141 @@
+import os
+import json
+from .mcp23s17 import (
+    MCP23S17,
+    get_spi_control_byte,
+    READ_CMD,
+    WRITE_CMD,
+    IOCON,
+    DEFVALA,
+    HAEN_ON,
+)
+
+
+MAX_HARDWARE_ADDRS = 8
+PROBE_ADDRESS = DEFVALA
+PROBE_PATTERN = 0xA5  # XORed with 0x11 * hardware_addr, never 0x00/0xFF
+DISCOVERY_CACHE_FILE = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'pifacecommon', 'discovery.json')
+
+# "<bus>.<chip_select>" -> {'present': [...], 'iocon': [...]}
+_discovered = dict()
+
+
+def discover(bus=0, chip_select=0, reprobe=False,
+             cache_file=DISCOVERY_CACHE_FILE):
+    """Returns the hardware addresses of the MCP23S17s on an SPI device.
+
+    IOCON is read from every address in one ioctl. Then, in a second ioctl,
+    HAEN is set on every chip (the other IOCON bits are left as they
+    were) and a different probe pattern is written to DEFVALA at every
+    address and read back. A third ioctl restores DEFVALA on the chips
+    found.
+
+    The result is cached per bus in memory and in `cache_file` (by default
+    in the user's cache directory), along with the IOCON value read back
+    from every address. Later calls (including from new processes) only
+    read IOCON from every address and reuse the cached result if nothing
+    changed.
+
+    :param bus: The SPI bus.
+    :type bus: int
+    :param chip_select: The SPI chip select.
+    :type chip_select: int
+    :param reprobe: Ignore the cached result.
+    :type reprobe: bool
+    :param cache_file: File to keep results in between processes, or None.
+    :type cache_file: str
+    :returns: list -- the populated hardware addresses
+    """
+    key = "%d.%d" % (bus, chip_select)
+    addrs = range(MAX_HARDWARE_ADDRS)
+    device = MCP23S17(0, bus, chip_select)
+    try:
+        replies = device.spisend_many(
+            [_message(addr, READ_CMD, IOCON) for addr in addrs])
+        iocon_values = [bytearray(reply)[2] for reply in replies]
+        if not reprobe:
+            if key not in _discovered and cache_file is not None:
+                _discovered.update(_load_cache(cache_file))
+            cached = _discovered.get(key)
+            if cached is not None and cached['iocon'] == iocon_values:
+                return list(cached['present'])
+
+        # with HAEN off every chip answers to address 0
+        messages = [_message(0, WRITE_CMD, IOCON, iocon_values[0] | HAEN_ON)]
+        messages += [_message(addr, READ_CMD, PROBE_ADDRESS)
+                     for addr in addrs]
+        messages += [_message(addr, WRITE_CMD, PROBE_ADDRESS, _pattern(addr))
+                     for addr in addrs]
+        messages += [_message(addr, READ_CMD, PROBE_ADDRESS)
+                     for addr in addrs]
+        messages += [_message(addr, READ_CMD, IOCON) for addr in addrs]
+        values = [bytearray(reply)[2]
+                  for reply in device.spisend_many(messages)[1:]]
+        n = MAX_HARDWARE_ADDRS
+        original_values = values[:n]
+        probed_values = values[2*n:3*n]
+        iocon_values = values[3*n:4*n]
+
+        present = [addr for addr in addrs
+                   if probed_values[addr] == _pattern(addr)]
+        if present:
+            device.spisend_many(
+                [_message(addr, WRITE_CMD, PROBE_ADDRESS,
+                          original_values[addr])
+                 for addr in present])
+    finally:
+        device.close_fd()
+
+    _discovered[key] = {'present': present, 'iocon': iocon_values}
+    if cache_file is not None:
+        _save_cache(cache_file)
+    return list(present)
+
+
+def _pattern(hardware_addr):
+    return PROBE_PATTERN ^ (0x11 * hardware_addr)
+
+
+def _message(hardware_addr, read_write_cmd, address, data=0):
+    ctrl_byte = get_spi_control_byte(hardware_addr, read_write_cmd)
+    return bytes(bytearray((ctrl_byte, address, data)))
+
+
+def _load_cache(cache_file):
+    """Returns the valid entries of the cache file."""
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return dict()
+    if not isinstance(cache, dict):
+        return dict()
+    return dict((key, entry) for key, entry in cache.items()
+                if _valid_entry(entry))
+
+
+def _valid_entry(entry):
+    try:
+        present = entry['present']
+        iocon_values = entry['iocon']
+    except (TypeError, KeyError):
+        return False
+    return (isinstance(present, list) and isinstance(iocon_values, list) and
+            len(iocon_values) == MAX_HARDWARE_ADDRS and
+            all(isinstance(addr, int) and 0 <= addr < MAX_HARDWARE_ADDRS
+                for addr in present) and
+            all(isinstance(value, int) and 0 <= value <= 0xFF
+                for value in iocon_values))
+
+
+def _save_cache(cache_file):
+    try:
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0o700)
+        with open(cache_file, 'w') as f:
+            json.dump(_discovered, f)
+    except (IOError, OSError):
+        pass  # only an optimisation
@@ -0,0 +1,145 @@
+from .mcp23s17 import (
+    READ_CMD,
+    IODIRA,
+    IPOLA,
+    GPINTENA,
+    DEFVALA,
+    INTCONA,
+    IOCON,
+    INTFA,
+    INTCAPA,
+    GPIOA,
+    OLATA,
+    SEQOP_OFF,
+    HAEN_ON,
+)
+
+
+NUM_REGISTERS = 0x16
+
+
+class MCP23S17Model(object):
+    """A software model of the MCP23S17s on one SPI chip select, in
+    IOCON.BANK = 0 mode. Messages are handled with :meth:`transfer` and
+    input pins are driven with :meth:`set_inputs`.
+
+    >>> model = pifacecommon.emulator.MCP23S17Model(hardware_addrs=(0, 1))
+    >>> model.transfer(b'\\x40\\x14\\x0f')  # write OLATA of board 0
+    b'\\x00\\x00\\x00'
+    >>> model.transfer(b'\\x41\\x14\\x00')  # read it back
+    b'\\x00\\x00\\x0f'
+    """
+    def __init__(self, hardware_addrs=(0,)):
+        """
+        :param hardware_addrs: The hardware addresses of the modelled chips.
+        :type hardware_addrs: list
+        """
+        self.registers = dict()  # hardware_addr -> bytearray
+        self.inputs = dict()  # hardware_addr -> [port A, port B] pin levels
+        for hardware_addr in hardware_addrs:
+            registers = bytearray(NUM_REGISTERS)
+            registers[IODIRA] = registers[IODIRA + 1] = 0xFF
+            self.registers[hardware_addr] = registers
+            self.inputs[hardware_addr] = [0, 0]
+
+    def transfer(self, tx):
+        """Handles one SPI message (one chip select assertion).
+
+        :param tx: The bytes sent.
+        :type tx: bytes
+        :returns: bytes -- the bytes received
+        """
+        tx = bytearray(tx)
+        rx = bytearray(len(tx))
+        if len(tx) < 2 or tx[0] & 0xF0 != 0x40:
+            return bytes(rx)
+        hardware_addr = (tx[0] >> 1) & 0x7
+        read = tx[0] & 1 == READ_CMD
+        for addr, registers in sorted(self.registers.items()):
+            if registers[IOCON] & HAEN_ON and addr != hardware_addr:
+                continue
+            address = tx[1]
+            for i in range(2, len(tx)):
+                if address >= NUM_REGISTERS:
+                    pass  # unimplemented addresses read as zero
+                elif read:
+                    rx[i] = self._read(addr, address)
+                else:
+                    self._write(addr, address, tx[i])
+                if registers[IOCON] & SEQOP_OFF:
+                    address ^= 1  # toggle between the A/B pair
+                else:
+                    address = (address + 1) % NUM_REGISTERS
+            if read:
+                break  # the first chip to answer drives MISO
+        return bytes(rx)
+
+    def set_inputs(self, hardware_addr, port, value):
+        """Drives the input pins of a port, flagging interrupts.
+
+        :param hardware_addr: The chip.
+        :type hardware_addr: int
+        :param port: 0 for port A, 1 for port B.
+        :type port: int
+        :param value: The pin levels.
+        :type value: int
+        """
+        old_value = self._gpio(hardware_addr, port)
+        self.inputs[hardware_addr][port] = value
+        new_value = self._gpio(hardware_addr, port)
+        changed = (old_value ^ new_value) & \
+            ~self.registers[hardware_addr][INTCONA + port]
+        self._flag(hardware_addr, port, new_value, changed)
+
+    def interrupt_asserted(self):
+        """Returns True if any chip has an interrupt flag set."""
+        return any(registers[INTFA] or registers[INTFA + 1]
+                   for registers in self.registers.values())
+
+    def _gpio(self, hardware_addr, port):
+        registers = self.registers[hardware_addr]
+        direction = registers[IODIRA + port]  # 1 = input
+        pins = ((self.inputs[hardware_addr][port] & direction) |
+                (registers[OLATA + port] & ~direction))
+        return (pins ^ (registers[IPOLA + port] & direction)) & 0xFF
+
+    def _read(self, hardware_addr, address):
+        registers = self.registers[hardware_addr]
+        port = address & 1
+        if address in (GPIOA, GPIOA + 1):
+            value = self._gpio(hardware_addr, port)
+            self._clear_interrupt(hardware_addr, port)
+            return value
+        value = registers[address]
+        if address in (INTCAPA, INTCAPA + 1):
+            self._clear_interrupt(hardware_addr, port)
+        return value
+
+    def _clear_interrupt(self, hardware_addr, port):
+        registers = self.registers[hardware_addr]
+        registers[INTFA + port] = 0
+        # a compare mode pin that still differs from DEFVAL interrupts again
+        self._flag(hardware_addr, port, self._gpio(hardware_addr, port), 0)
+
+    def _flag(self, hardware_addr, port, value, changed):
+        """Flags an interrupt for changed pins and compare mode pins that
+        differ from DEFVAL, unless one is already flagged.
+        """
+        registers = self.registers[hardware_addr]
+        compare = registers[INTCONA + port]
+        differs = (value ^ registers[DEFVALA + port]) & compare
+        flagged = (changed | differs) & registers[GPINTENA + port]
+        if flagged and registers[INTFA + port] == 0:
+            registers[INTFA + port] = flagged
+            registers[INTCAPA + port] = value
+
+    def _write(self, hardware_addr, address, value):
+        registers = self.registers[hardware_addr]
+        if address in (IOCON, IOCON + 1):
+            registers[IOCON] = registers[IOCON + 1] = value
+        elif address in (GPIOA, GPIOA + 1):
+            registers[OLATA + (address & 1)] = value
+        elif address in (INTFA, INTFA + 1, INTCAPA, INTCAPA + 1):
+            pass  # read only
+        else:
+            registers[address] = value
@@ -0,0 +1,187 @@
+import os
+import time
+import struct
+import select
+import collections
+from multiprocessing import shared_memory
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from .interrupts import EventQueue, InterruptEvent, STAT_RING_OVERFLOWS
+
+
+DEFAULT_CAPACITY = 1024  # events
+# head and tail on their own cache lines, then the records
+HEAD_OFFSET = 0
+TAIL_OFFSET = 64
+RECORDS_OFFSET = 128
+INDEX = struct.Struct('<Q')
+# interrupt flag, interrupt capture, chip id, port, timestamp
+RECORD = struct.Struct('<BBBB4xd')
+
+
+class Wakeup(object):
+    """A file descriptor that becomes readable when signalled. An eventfd
+    where available (Python 3.10+), otherwise a pipe.
+    """
+    def __init__(self):
+        if hasattr(os, 'eventfd'):
+            self.read_fd = self.write_fd = os.eventfd(
+                0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+            os.set_blocking(self.read_fd, False)
+
+    def fileno(self):
+        return self.read_fd
+
+    def signal(self):
+        if self.read_fd == self.write_fd:
+            os.eventfd_write(self.write_fd, 1)
+        else:
+            os.write(self.write_fd, b'\x00')
+
+    def clear(self):
+        try:
+            if self.read_fd == self.write_fd:
+                os.eventfd_read(self.read_fd)
+            else:
+                while os.read(self.read_fd, 4096):
+                    pass
+        except (OSError, IOError):  # nothing to read
+            pass
+
+    def wait(self, timeout=None):
+        """Returns True if signalled within timeout seconds."""
+        return bool(select.select((self.read_fd,), (), (), timeout)[0])
+
+    def close(self):
+        os.close(self.read_fd)
+        if self.write_fd != self.read_fd:
+            os.close(self.write_fd)
+
+
+class RingEventQueue(EventQueue):
+    """An :class:`pifacecommon.interrupts.EventQueue` that passes events
+    from the detector process to the dispatcher through a fixed size ring
+    in shared memory instead of a multiprocessing.Queue. Nothing is
+    pickled: each event is a 16 byte record of (flag, capture, chip id,
+    port, timestamp) and the consumer rebuilds the
+    :class:`pifacecommon.interrupts.InterruptEvent` from the chip table.
+
+    There must be a single producer (the detector) and a single consumer
+    (the dispatcher). The consumer sleeps on a :class:`Wakeup` which the
+    producer only signals when the ring goes from empty to non empty.
+    Events that don't fit are dropped and counted in the ring_overflows
+    stat. Other things put on the queue (the terminate signal) are passed
+    within the consumer's process. The detector must be started with fork
+    (the default on Linux).
+    """
+    def __init__(self, pin_function_maps, chips, port,
+                 capacity=DEFAULT_CAPACITY):
+        """
+        :param pin_function_maps: The registered functions (for filtering).
+        :type pin_function_maps: list
+        :param chips: The chips events can come from (the chip table).
+        :type chips: list
+        :param port: The port events come from (GPIOA/GPIOB).
+        :type port: int
+        :param capacity: The number of events the ring can hold.
+        :type capacity: int
+        """
+        super(RingEventQueue, self).__init__(pin_function_maps)
+        self.chips = list(chips)
+        self.port = port
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=RECORDS_OFFSET + capacity * RECORD.size)
+        self.buf = self.shm.buf
+        INDEX.pack_into(self.buf, HEAD_OFFSET, 0)
+        INDEX.pack_into(self.buf, TAIL_OFFSET, 0)
+        self.head = 0  # producer's copy
+        self.tail = 0  # consumer's copy
+        self.wakeup = Wakeup()
+        self.control = collections.deque()  # consumer side only
+
+    def _open(self):
+        pass  # no multiprocessing.Queue
+
+    def put(self, thing):
+        if not isinstance(thing, InterruptEvent):
+            self.control.append(thing)
+            self.wakeup.signal()
+            return
+
+        head = self.head
+        tail = INDEX.unpack_from(self.buf, TAIL_OFFSET)[0]
+        if head - tail >= self.capacity:
+            self.stats[STAT_RING_OVERFLOWS] += 1
+            return
+        RECORD.pack_into(
+            self.buf, RECORDS_OFFSET + (head % self.capacity) * RECORD.size,
+            thing.interrupt_flag, thing.interrupt_capture,
+            self.chips.index(thing.chip), self.port, thing.timestamp)
+        self.head = head + 1
+        INDEX.pack_into(self.buf, HEAD_OFFSET, self.head)  # publish
+        # if the consumer had taken everything before this event it might
+        # be waiting, otherwise it will find this event before it waits
+        if INDEX.unpack_from(self.buf, TAIL_OFFSET)[0] == head:
+            self.wakeup.signal()
+
+    def get(self, timeout=None):
+        """Returns the next event, or the next thing put by the consumer's
+        process once the ring is empty.
+
+        :param timeout: Seconds to wait (default: forever).
+        :type timeout: float
+        :raises: :py:class:`queue.Empty` if nothing arrives in time
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            event = self._pop()
+            if event is not None:
+                return event
+            if self.control:
+                return self.control.popleft()
+            if timeout is None:
+                remaining = None
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty
+            # anything published after this will signal again
+            if self.wakeup.wait(remaining):
+                self.wakeup.clear()
+
+    def drain(self):
+        """Returns every event on the ring without waiting.
+
+        :returns: list -- :class:`pifacecommon.interrupts.InterruptEvent`
+        """
+        # clear first, events published after the last pop signal again
+        self.wakeup.clear()
+        events = list()
+        event = self._pop()
+        while event is not None:
+            events.append(event)
+            event = self._pop()
+        return events
+
+    def close(self):
+        """Frees the shared memory and the wakeup file descriptors."""
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+        self.wakeup.close()
+
+    def _pop(self):
+        tail = self.tail
+        if tail == INDEX.unpack_from(self.buf, HEAD_OFFSET)[0]:
+            return None
+        flag, capture, chip_id, port, timestamp = RECORD.unpack_from(
+            self.buf, RECORDS_OFFSET + (tail % self.capacity) * RECORD.size)
+        self.tail = tail + 1
+        INDEX.pack_into(self.buf, TAIL_OFFSET, self.tail)
+        return InterruptEvent(flag, capture, self.chips[chip_id], timestamp)
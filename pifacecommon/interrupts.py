@@ -1,10 +1,15 @@
-import threading
-import multiprocessing
-import select
 import time
 import errno
-from .core import get_bit_num
-import pifacecommon.mcp23s17
+import heapq
+import itertools
+import collections
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from .core import get_bit_num, get_bit_mask, monotonic
+# multiprocessing, threading and select are imported when a listener is
+# created since they are slow to import and most programs don't need them
 
 
 # interrupts
@@ -29,6 +34,55 @@ READY_FOR_EVENTS = "ready for events"
 # deboucing
 DEFAULT_SETTLE_TIME = 0.020  # 20ms
 
+# missed interrupt recovery
+WATCHDOG_TIMEOUT = 1  # seconds without interrupts before checking the line
+POLL_INTERVAL = 0.001  # seconds between reads when polling
+STORM_RATE = 1000  # interrupts per second before switching to polling
+STORM_WINDOW = 0.1  # seconds over which the interrupt rate is measured
+QUIET_TIME = 0.5  # seconds without events before going back to interrupts
+
+# listeners that program their chip's interrupt registers, the values last
+# written to each chip: (bus, chip_select, hardware_addr) ->
+# (chip, {address: value}), and each chip's IOCON from before it was managed
+_managed_listeners = list()
+_interrupt_registers = dict()
+_original_iocon = dict()
+
+# EventQueue.stats indexes
+(STAT_INTERRUPTS,
+ STAT_SOFTWARE_FILTERED,
+ STAT_WATCHDOG_CHECKS,
+ STAT_WATCHDOG_RECOVERIES,
+ STAT_POLL_MODE,
+ STAT_POLL_MODE_ENTRIES,
+ STAT_INTERRUPT_MODE_ENTRIES,
+ STAT_RING_OVERFLOWS) = range(8)
+STAT_NAMES = (
+    'interrupts',  # interrupts flagged on the port
+    'software_filtered',  # interrupts that matched no registered function
+    'watchdog_checks',  # timeouts that found the interrupt line asserted
+    'watchdog_recoveries',  # ...and found flags that were then cleared
+    'poll_mode',  # 1 while polling instead of waiting for interrupts
+    'poll_mode_entries',  # switches to polling
+    'interrupt_mode_entries',  # switches back to waiting for interrupts
+    'ring_overflows',  # events dropped by a full RingEventQueue
+)
+
+# priority lanes, higher priority events are dispatched first
+PRIORITY_LOW = -1
+PRIORITY_NORMAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_CRITICAL = 2
+
+# edge counters
+PERIOD_SMOOTHING = 0.25  # weight of the newest period in the estimate
+STALE_PERIODS = 4  # periods without an edge before the frequency reads 0
+
+EdgeCounter = collections.namedtuple(
+    'EdgeCounter', ['falling', 'rising', 'period', 'frequency', 'last_edge'])
+EdgeCounter.__doc__ = """The edges counted on a pin, its estimated period
+(seconds) and frequency (Hz), and the monotonic time of its last edge."""
+
 
 class Timeout(Exception):
     pass
@@ -79,9 +133,12 @@ class FunctionMap(object):
 
 class PinFunctionMap(FunctionMap):
     """Maps an IO pin and a direction to callback function."""
-    def __init__(self, pin_num, direction, callback, settle_time):
+    def __init__(self, pin_num, direction, callback, settle_time,
+                 priority=PRIORITY_NORMAL, debounce=True):
         self.pin_num = pin_num
         self.direction = direction
+        self.priority = priority
+        self.debounce = debounce
         super(PinFunctionMap, self).__init__(callback, settle_time)
 
     def __str__(self):
@@ -97,7 +154,40 @@ class EventQueue(object):
         super(EventQueue, self).__init__()
         self.last_event_time = [0]*8  # last event time on each pin
         self.pin_function_maps = pin_function_maps
-        self.queue = multiprocessing.Queue()
+        self._open()
+        import multiprocessing
+        # shared with the detector process
+        self.stats = multiprocessing.Array('L', len(STAT_NAMES), lock=False)
+        # edge counters, indexed by pin_num * 2 + direction
+        self.edge_counts = multiprocessing.Array('L', 16, lock=False)
+        self.edge_times = multiprocessing.Array('d', 16, lock=False)
+        # smoothed period of each pin
+        self.edge_periods = multiprocessing.Array('d', 8, lock=False)
+        # pins counted without a callback
+        self.counted_pins = multiprocessing.Value('B', 0, lock=False)
+
+    def count_edges(self, interrupt_flag, interrupt_capture, timestamp):
+        """Counts the edges on the flagged pins and updates their period
+        estimates. Called by the detector for every interrupt.
+        """
+        pin_num = 0
+        while interrupt_flag:
+            if interrupt_flag & 1:
+                direction = (interrupt_capture >> pin_num) & 1
+                i = pin_num * 2 + direction
+                last_time = self.edge_times[i]
+                if self.edge_counts[i] > 0:
+                    # a full period is from one edge to the next alike one
+                    period = timestamp - last_time
+                    old_period = self.edge_periods[pin_num]
+                    if old_period > 0:
+                        period = old_period + \
+                            PERIOD_SMOOTHING * (period - old_period)
+                    self.edge_periods[pin_num] = period
+                self.edge_counts[i] += 1
+                self.edge_times[i] = timestamp
+            interrupt_flag >>= 1
+            pin_num += 1
 
     def add_event(self, event):
         """Adds events to the queue. Will ignore events that occur before the
@@ -106,6 +196,16 @@ class EventQueue(object):
         """
         # print("Trying to add event:")
         # print(event)
+        self.stats[STAT_INTERRUPTS] += 1
+
+        # pins registered without debouncing go straight onto the queue
+        for pin_function_map in self.pin_function_maps:
+            if not pin_function_map.debounce and \
+                    _event_matches_pin_function_map(event, pin_function_map):
+                self.put(event)
+                self.last_event_time[event.pin_num] = event.timestamp
+                return
+
         # find out the pin settle time
         for pin_function_map in self.pin_function_maps:
             if _event_matches_pin_function_map(event, pin_function_map):
@@ -120,6 +220,8 @@ class EventQueue(object):
             # print("EventQueue: Couldn't find event in map:")
             # for pin_function_map in self.pin_function_maps:
             #     print(pin_function_map)
+            if not self.counted_pins.value & event.interrupt_flag:
+                self.stats[STAT_SOFTWARE_FILTERED] += 1
             return
 
         threshold_time = self.last_event_time[event.pin_num] + pin_settle_time
@@ -127,11 +229,143 @@ class EventQueue(object):
             self.put(event)
             self.last_event_time[event.pin_num] = event.timestamp
 
+    def _open(self):
+        import multiprocessing
+        self.queue = multiprocessing.Queue()
+
     def put(self, thing):
         self.queue.put(thing)
 
+    def get(self, timeout=None):
+        """Returns the next thing on the queue.
+
+        :param timeout: Seconds to wait (default: forever).
+        :type timeout: float
+        :raises: :py:class:`queue.Empty` if nothing arrives in time
+        """
+        return self.queue.get(timeout=timeout)
+
+    def close(self):
+        pass
+
+
+class PriorityLanes(object):
+    """Events waiting to be dispatched, in a FIFO lane for each priority.
+    An event goes in the lane of the highest priority function it matches
+    and the highest priority lane is always emptied first. The depth of
+    each lane and the latency from an event's timestamp to its dispatch are
+    recorded.
+    """
+    def __init__(self, function_maps, event_matches_function_map):
+        self.function_maps = function_maps
+        self.event_matches_function_map = event_matches_function_map
+        self.lanes = dict()  # priority -> deque of events
+        self.priorities = list()  # highest first
+        # priority -> [max depth, dispatched, total latency, max latency]
+        self.lane_stats = dict()
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def put(self, event):
+        priority = None
+        for function_map in self.function_maps:
+            if self.event_matches_function_map(event, function_map):
+                fm_priority = getattr(
+                    function_map, 'priority', PRIORITY_NORMAL)
+                if priority is None or fm_priority > priority:
+                    priority = fm_priority
+        if priority is None:
+            priority = PRIORITY_NORMAL
+        lane = self.lanes.get(priority)
+        if lane is None:
+            lane = self.lanes[priority] = collections.deque()
+            self.lane_stats[priority] = [0, 0, 0.0, 0.0]
+            self.priorities = sorted(self.lanes, reverse=True)
+        lane.append(event)
+        stats = self.lane_stats[priority]
+        stats[0] = max(stats[0], len(lane))
+
     def get(self):
-        return self.queue.get()
+        """Returns the oldest event of the highest priority lane, or None
+        if every lane is empty.
+        """
+        for priority in self.priorities:
+            lane = self.lanes[priority]
+            if lane:
+                event = lane.popleft()
+                latency = time.time() - event.timestamp
+                stats = self.lane_stats[priority]
+                stats[1] += 1
+                stats[2] += latency
+                stats[3] = max(stats[3], latency)
+                return event
+        return None
+
+    def stats(self):
+        """Returns the depth and dispatch latency (seconds) of each lane.
+
+        :returns: dict -- priority -> {'depth', 'max_depth', 'dispatched',
+            'mean_latency', 'max_latency'}
+        """
+        return dict(
+            (priority, {'depth': len(self.lanes[priority]),
+                        'max_depth': max_depth,
+                        'dispatched': dispatched,
+                        'mean_latency':
+                            total_latency / dispatched if dispatched else 0.0,
+                        'max_latency': max_latency})
+            for priority, (max_depth, dispatched, total_latency, max_latency)
+            in list(self.lane_stats.items()))
+
+
+class Timer(object):
+    """A function that a :class:`TimerQueue` will call at a deadline."""
+    def __init__(self, deadline, function, args):
+        self.deadline = deadline
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue(object):
+    """Timers run by the dispatcher thread in between events, so callbacks
+    can schedule work without starting a thread for each timer. Timers
+    should only be added from the dispatcher thread (i.e. from callbacks).
+    """
+    def __init__(self):
+        self.heap = list()  # (deadline, sequence number, timer)
+        self.sequence = itertools.count()
+
+    def call_later(self, delay, function, *args):
+        """Calls function(*args) after delay seconds.
+
+        :returns: :class:`Timer` -- which can be cancelled
+        """
+        timer = Timer(monotonic() + delay, function, args)
+        heapq.heappush(self.heap, (timer.deadline, next(self.sequence), timer))
+        return timer
+
+    def timeout(self):
+        """Returns the seconds until the next timer is due, or None if there
+        are no timers.
+        """
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(0, self.heap[0][0] - monotonic())
+
+    def run_due(self):
+        """Calls the functions of every timer that is due."""
+        now = monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, sequence, timer = heapq.heappop(self.heap)
+            if not timer.cancelled:
+                timer.function(*timer.args)
 
 
 class PortEventListener(object):
@@ -148,31 +382,73 @@ class PortEventListener(object):
 
     TERMINATE_SIGNAL = "astalavista"
 
-    def __init__(self, port, chip, return_after_kbdint=True, daemon=False):
+    def __init__(self, port, chip, return_after_kbdint=True, daemon=False,
+                 manage_interrupts=False, shared_ring=False,
+                 detector_realtime=None, dispatcher_realtime=None):
+        """
+        :param port: The port to listen on (GPIOA/GPIOB).
+        :type port: int
+        :param chip: The chip to listen to.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param return_after_kbdint: Stop quietly on KeyboardInterrupt.
+        :type return_after_kbdint: bool
+        :param daemon: Run the detector and dispatcher as daemons.
+        :type daemon: bool
+        :param manage_interrupts: While active, program GPINTEN and INTCON
+            so that only registered pins interrupt, and IOCON (INT_MIRROR,
+            ODR) for when several ports or chips share the interrupt line.
+        :type manage_interrupts: bool
+        :param shared_ring: Pass events from the detector through a ring in
+            shared memory instead of a multiprocessing.Queue (see
+            :class:`pifacecommon.eventring.RingEventQueue`).
+        :type shared_ring: bool
+        :param detector_realtime: Real-time scheduling, CPU affinity and
+            memory locking for the detector process.
+        :type detector_realtime: :class:`pifacecommon.realtime.RealtimeOptions`
+        :param dispatcher_realtime: The same for the dispatcher thread.
+        :type dispatcher_realtime:
+            :class:`pifacecommon.realtime.RealtimeOptions`
+        """
+        import multiprocessing
+        import threading
         self.port = port
         self.chip = chip
+        self.manage_interrupts = manage_interrupts
         self.pin_function_maps = list()
-        self.event_queue = EventQueue(self.pin_function_maps)
+        self.counted_pins = 0  # bit mask of pins counted without callbacks
+        self._waiting_events = collections.deque()  # see wait_for
+        if shared_ring:
+            from .eventring import RingEventQueue
+            self.event_queue = RingEventQueue(
+                self.pin_function_maps, (chip,), port)
+        else:
+            self.event_queue = EventQueue(self.pin_function_maps)
         self.detector = multiprocessing.Process(
-            target=watch_port_events,
-            args=(
+            target=_realtime_target(watch_port_events, detector_realtime),
+            args=_realtime_args(watch_port_events, detector_realtime) + (
                 self.port,
                 self.chip,
                 self.pin_function_maps,
                 self.event_queue,
                 return_after_kbdint))
         self.detector.daemon = daemon
+        self.timers = TimerQueue()
+        self.lanes = PriorityLanes(
+            self.pin_function_maps, _event_matches_pin_function_map)
         self.dispatcher = threading.Thread(
-            target=handle_events,
-            args=(
+            target=_realtime_target(handle_events, dispatcher_realtime),
+            args=_realtime_args(handle_events, dispatcher_realtime) + (
                 self.pin_function_maps,
                 self.event_queue,
                 _event_matches_pin_function_map,
-                PortEventListener.TERMINATE_SIGNAL))
+                PortEventListener.TERMINATE_SIGNAL,
+                self.timers,
+                self.lanes))
         self.dispatcher.daemon = daemon
 
     def register(self, pin_num, direction, callback,
-                 settle_time=DEFAULT_SETTLE_TIME):
+                 settle_time=DEFAULT_SETTLE_TIME, priority=PRIORITY_NORMAL,
+                 debounce=True):
         """Registers a pin number and direction to a callback function.
 
         :param pin_num: The pin pin number.
@@ -180,13 +456,126 @@ class PortEventListener(object):
         :param direction: The event direction
             (use: IODIR_ON/IODIR_OFF/IODIR_BOTH)
         :type direction: int
-        :param callback: The function to run when event is detected.
+        :param callback: The function to run when event is detected (None
+            if events are only consumed with :meth:`drain`).
         :type callback: function
         :param settle_time: Time within which subsequent events are ignored.
         :type settle_time: int
+        :param priority: Events are dispatched from the highest priority
+            lane first (e.g. PRIORITY_CRITICAL for an emergency stop).
+        :type priority: int
+        :param debounce: If False every event on the pin is queued,
+            ignoring settle times.
+        :type debounce: bool
+        """
+        self.pin_function_maps.append(PinFunctionMap(
+            pin_num, direction, callback, settle_time, priority, debounce))
+        if self in _managed_listeners:
+            self._update_interrupts()
+
+    def fileno(self):
+        """Returns a file descriptor that is readable while events are
+        waiting to be drained, for use with select/epoll or another event
+        loop. It stays readable until :meth:`drain` is called. Needs
+        shared_ring and activate(dispatch=False).
+
+        :raises: ValueError
+        """
+        if not hasattr(self.event_queue, 'wakeup'):
+            raise ValueError(
+                "Only listeners created with shared_ring=True are pollable.")
+        return self.event_queue.wakeup.fileno()
+
+    def drain(self):
+        """Returns every waiting event without blocking. Needs
+        shared_ring and activate(dispatch=False).
+
+        :returns: list -- :class:`InterruptEvent`
+        """
+        self.fileno()  # check this listener is pollable
+        events = list(self._waiting_events)
+        self._waiting_events.clear()
+        events.extend(self.event_queue.drain())
+        return events
+
+    def wait_for(self, pin_num, direction=IODIR_BOTH, timeout=None):
+        """Waits for an event on a pin, without a dispatcher thread. Other
+        events that arrive in the meantime are kept for :meth:`drain`.
+        Needs shared_ring and activate(dispatch=False).
+
+        :param pin_num: The pin number.
+        :type pin_num: int
+        :param direction: The event direction
+            (use: IODIR_ON/IODIR_OFF/IODIR_BOTH)
+        :type direction: int
+        :param timeout: Seconds to wait (default: forever).
+        :type timeout: float
+        :returns: :class:`InterruptEvent` -- or None if the timeout passed
+        """
+        self.fileno()  # check this listener is pollable
+        wanted = PinFunctionMap(pin_num, direction, None, None)
+        wakeup = self.event_queue.wakeup
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            for event in self._waiting_events:
+                if _event_matches_pin_function_map(event, wanted):
+                    self._waiting_events.remove(event)
+                    return event
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            if wakeup.wait(remaining):
+                self._waiting_events.extend(self.event_queue.drain())
+
+    def count(self, pin_num):
+        """Counts the edges on a pin (see :meth:`counters`) without
+        registering a callback. The edges of registered pins are always
+        counted. Pulses on counted pins are not put on the event queue.
+        The pin must interrupt: with manage_interrupts it is enabled in
+        GPINTEN for you, otherwise enable it yourself.
+
+        :param pin_num: The pin number.
+        :type pin_num: int
         """
-        self.pin_function_maps.append(
-            PinFunctionMap(pin_num, direction, callback, settle_time))
+        self.counted_pins |= get_bit_mask(pin_num)
+        self.event_queue.counted_pins.value = self.counted_pins
+        if self in _managed_listeners:
+            self._update_interrupts()
+
+    def counters(self):
+        """Returns the edge counters of every pin on the port. They are
+        kept in shared memory by the detector, so this doesn't wait for
+        the dispatcher or any callbacks.
+
+        :returns: list -- an :class:`EdgeCounter` for each pin
+        """
+        event_queue = self.event_queue
+        counts = event_queue.edge_counts[:]
+        times = event_queue.edge_times[:]
+        periods = event_queue.edge_periods[:]
+        now = monotonic()
+        counters = list()
+        for pin_num in range(8):
+            last_edge = max(times[pin_num*2], times[pin_num*2+1])
+            period = periods[pin_num]
+            if period > 0 and now - last_edge < STALE_PERIODS * period:
+                frequency = 1.0 / period
+            else:
+                frequency = 0.0
+            counters.append(EdgeCounter(
+                counts[pin_num*2+IODIR_FALLING_EDGE],
+                counts[pin_num*2+IODIR_RISING_EDGE],
+                period, frequency, last_edge))
+        return counters
+
+    def reset_counters(self):
+        """Sets the edge counters back to zero."""
+        event_queue = self.event_queue
+        for i in range(16):
+            event_queue.edge_counts[i] = 0
+            event_queue.edge_times[i] = 0
+        for pin_num in range(8):
+            event_queue.edge_periods[pin_num] = 0
 
     def deregister(self, pin_num=None, direction=None):
         """De-registers callback functions
@@ -206,22 +595,69 @@ class PortEventListener(object):
                 to_delete.append(i)
         for i in reversed(to_delete):
             del self.pin_function_maps[i]
+        if self in _managed_listeners:
+            self._update_interrupts()
 
-    def activate(self):
+    def activate(self, dispatch=True):
         """When activated the :class:`PortEventListener` will run callbacks
         associated with pins/directions.
+
+        :param dispatch: Start the dispatcher thread. Without it events are
+            only consumed with :meth:`drain` and :meth:`wait_for`.
+        :type dispatch: bool
         """
+        if self.manage_interrupts:
+            _managed_listeners.append(self)
+            self._update_interrupts()
         self.detector.start()
-        self.dispatcher.start()
+        if dispatch:
+            self.dispatcher.start()
 
     def deactivate(self):
         """When deactivated the :class:`PortEventListener` will not run
         anything.
         """
-        self.event_queue.put(self.TERMINATE_SIGNAL)
-        self.dispatcher.join()
+        if self.dispatcher.is_alive():
+            self.event_queue.put(self.TERMINATE_SIGNAL)
+            self.dispatcher.join()
         self.detector.terminate()
         self.detector.join()
+        self.event_queue.close()
+        if self in _managed_listeners:
+            _managed_listeners.remove(self)
+            _configure_interrupts()
+
+    def interrupt_config(self):
+        """Returns the (GPINTEN, INTCON, DEFVAL) values this listener needs
+        on its port: only registered and counted pins are enabled and they
+        interrupt on any change.
+
+        The direction of an event is matched in software. DEFVAL compare
+        mode can't stand in for it: a pin keeps the interrupt asserted for
+        as long as it differs from DEFVAL, so its release would have to be
+        polled for or interrupt anyway.
+        """
+        interrupt_enable = self.counted_pins
+        for pin_function_map in self.pin_function_maps:
+            interrupt_enable |= get_bit_mask(pin_function_map.pin_num)
+        return interrupt_enable, 0, 0
+
+    def lane_stats(self):
+        """Returns the queue depth and dispatch latency of each priority
+        lane (see :meth:`PriorityLanes.stats`).
+        """
+        return self.lanes.stats()
+
+    def interrupt_stats(self):
+        """Returns the interrupt counters of this listener (see
+        STAT_NAMES).
+
+        :returns: dict -- counter name -> count
+        """
+        return dict(zip(STAT_NAMES, self.event_queue.stats))
+
+    def _update_interrupts(self):
+        _configure_interrupts()
 
 
 class GPIOInterruptDevice(object):
@@ -243,6 +679,88 @@ class GPIOInterruptDevice(object):
         deactivate_gpio_interrupt()
 
 
+def _configure_interrupts():
+    """Programs the interrupt registers of every chip that has (or had) a
+    managed listener, writing only the registers that changed in one batch
+    per chip. INT_MIRROR is set on chips listened to on both ports and ODR
+    is set when more than one chip shares the interrupt line, on top of the
+    IOCON bits the chip had before it was managed. That IOCON is written
+    back once no managed listener uses the chip.
+    """
+    from .mcp23s17 import (
+        GPIOA, GPINTENA, GPINTENB, INTCONA, INTCONB, DEFVALA, DEFVALB, IOCON,
+        INT_MIRROR_ON, ODR_ON, WRITE_CMD)
+
+    # chip key -> (chip, {address: value}) from the active listeners
+    wanted = dict()
+    for listener in _managed_listeners:
+        chip = listener.chip
+        key = (chip.bus, chip.chip_select, chip.hardware_addr)
+        chip, registers = wanted.setdefault(key, (chip, dict()))
+        if listener.port == GPIOA:
+            addresses = (GPINTENA, INTCONA, DEFVALA)
+        else:
+            addresses = (GPINTENB, INTCONB, DEFVALB)
+        for address, value in zip(addresses, listener.interrupt_config()):
+            registers[address] = registers.get(address, 0) | value
+
+    shared_line = len(wanted) > 1
+    for key in set(wanted) | set(_interrupt_registers):
+        if key in wanted:
+            chip, registers = wanted[key]
+        else:
+            chip, registers = _interrupt_registers[key][0], dict()
+        written = _interrupt_registers.setdefault(key, (chip, dict()))[1]
+        for address in (GPINTENA, GPINTENB):
+            registers.setdefault(address, 0)
+
+        if key not in _original_iocon:
+            _original_iocon[key] = written[IOCON] = chip.read(IOCON)
+        iocon = _original_iocon[key]
+        if key in wanted:
+            if registers[GPINTENA] and registers[GPINTENB]:
+                iocon |= INT_MIRROR_ON
+            if shared_line:
+                iocon |= ODR_ON
+        registers[IOCON] = iocon
+
+        # IOCON first, enables last
+        ctrl_byte = chip._get_spi_control_byte(WRITE_CMD)
+        messages = list()
+        for address in (IOCON, INTCONA, INTCONB, DEFVALA, DEFVALB,
+                        GPINTENA, GPINTENB):
+            if address in registers and \
+                    written.get(address) != registers[address]:
+                messages.append(bytes(bytearray(
+                    (ctrl_byte, address, registers[address]))))
+                written[address] = registers[address]
+        if messages:
+            chip.spisend_many(messages)
+        if key not in wanted:
+            # released, read IOCON again if it is managed later
+            del _interrupt_registers[key]
+            del _original_iocon[key]
+
+
+def _realtime_target(function, realtime_options):
+    """Returns the target that runs function with the real-time options
+    applied (see :func:`pifacecommon.realtime.run_with`).
+    """
+    if realtime_options is None:
+        return function
+    from .realtime import run_with
+    return run_with
+
+
+def _realtime_args(function, realtime_options):
+    """Returns the arguments to put before function's for
+    :func:`_realtime_target`.
+    """
+    if realtime_options is None:
+        return ()
+    return (realtime_options, function)
+
+
 def _event_matches_pin_function_map(event, pin_function_map):
     # print("pin num", event.pin_num, pin_function_map.pin_num)
     # print("direction", event.direction, pin_function_map.direction)
@@ -253,10 +771,21 @@ def _event_matches_pin_function_map(event, pin_function_map):
 
 
 def watch_port_events(port, chip, pin_function_maps, event_queue,
-                      return_after_kbdint=False):
+                      return_after_kbdint=False,
+                      watchdog_timeout=WATCHDOG_TIMEOUT,
+                      poll_interval=POLL_INTERVAL,
+                      storm_rate=STORM_RATE,
+                      quiet_time=QUIET_TIME):
     """Waits for a port event. When a port event occurs it is placed onto the
     event queue.
 
+    If no interrupt arrives within `watchdog_timeout` the interrupt line is
+    checked and, if it is asserted, the interrupt flags are read (clearing
+    them) in case an edge was missed. During interrupt storms, or when the
+    line stays asserted, the flags are polled every `poll_interval` instead
+    until the port has been quiet for `quiet_time`. Mode switches are
+    counted in the event queue's stats.
+
     :param port: The port we are waiting for interrupts on (GPIOA/GPIOB).
     :type port: int
     :param chip: The chip we are waiting for interrupts on.
@@ -265,17 +794,39 @@ def watch_port_events(port, chip, pin_function_maps, event_queue,
         :class:`FunctionMap`\ s describing what to do with events.
     :type pin_function_maps: list
     :param event_queue: A queue to put events on.
-    :type event_queue: :py:class:`multiprocessing.Queue`
+    :type event_queue: :class:`EventQueue`
+    :param watchdog_timeout: Seconds without interrupts before checking the
+        interrupt line.
+    :type watchdog_timeout: float
+    :param poll_interval: Seconds between reads in polling mode.
+    :type poll_interval: float
+    :param storm_rate: Interrupts per second above which to poll instead.
+    :type storm_rate: int
+    :param quiet_time: Seconds without events before leaving polling mode.
+    :type quiet_time: float
     """
+    import select
+    from .mcp23s17 import GPIOA
+
     # set up epoll
     gpio25 = open(GPIO_INTERRUPT_DEVICE_VALUE, 'r')  # change to use 'with'?
     epoll = select.epoll()
     epoll.register(gpio25, select.EPOLLIN | select.EPOLLET)
 
+    stats = event_queue.stats
+    polling = False
+    last_flagged = None  # (flag, capture) last put on the queue
+    last_event_time = window_start = monotonic()
+    window_count = 0
+
     while True:
         # wait here until input
+        events = None
         try:
-            events = epoll.poll()
+            if polling:
+                time.sleep(poll_interval)
+            else:
+                events = epoll.poll(watchdog_timeout)
         except KeyboardInterrupt as e:
             if return_after_kbdint:
                 return
@@ -287,28 +838,72 @@ def watch_port_events(port, chip, pin_function_maps, event_queue,
             if e.errno != errno.EINTR:
                 raise
 
+        watchdog = not polling and not events
+        if watchdog:
+            if not _interrupt_line_asserted(gpio25):
+                continue  # nothing was missed
+            stats[STAT_WATCHDOG_CHECKS] += 1
+
         # find out where the interrupt came from and put it on the event queue
-        if port == pifacecommon.mcp23s17.GPIOA:
+        if port == GPIOA:
             interrupt_flag = chip.intfa.value
         else:
             interrupt_flag = chip.intfb.value
 
+        now = monotonic()
         if interrupt_flag == 0:
-            continue  # The interrupt has not been flagged on this board
+            # The interrupt has not been flagged on this board
+            last_flagged = None
         else:
-            if port == pifacecommon.mcp23s17.GPIOA:
+            if port == GPIOA:
                 interrupt_capture = chip.intcapa.value
             else:
                 interrupt_capture = chip.intcapb.value
-            event_queue.add_event(InterruptEvent(
-                interrupt_flag, interrupt_capture, chip, time.time()))
+            if watchdog:
+                stats[STAT_WATCHDOG_RECOVERIES] += 1
+            # while polling, a flag that is still set from last time (a
+            # compare mode pin held on a chip we don't manage) is not a new
+            # event
+            if not polling or \
+                    last_flagged != (interrupt_flag, interrupt_capture):
+                event_queue.count_edges(
+                    interrupt_flag, interrupt_capture, now)
+                event_queue.add_event(InterruptEvent(
+                    interrupt_flag, interrupt_capture, chip, time.time()))
+                last_event_time = now
+                window_count += 1
+            last_flagged = (interrupt_flag, interrupt_capture)
+
+        storm = False
+        if now - window_start >= STORM_WINDOW:
+            storm = window_count > storm_rate * (now - window_start)
+            window_start = now
+            window_count = 0
+
+        if not polling:
+            if storm or \
+                    (watchdog and _interrupt_line_asserted(gpio25)):
+                polling = True
+                stats[STAT_POLL_MODE] = 1
+                stats[STAT_POLL_MODE_ENTRIES] += 1
+        elif now - last_event_time >= quiet_time and \
+                not _interrupt_line_asserted(gpio25):
+            polling = False
+            stats[STAT_POLL_MODE] = 0
+            stats[STAT_INTERRUPT_MODE_ENTRIES] += 1
 
     epoll.close()
 
 
+def _interrupt_line_asserted(gpio_value_file):
+    """Returns True if the (active low) interrupt line is asserted."""
+    gpio_value_file.seek(0)
+    return gpio_value_file.read().strip() == '0'
+
+
 def handle_events(
         function_maps, event_queue, event_matches_function_map,
-        terminate_signal):
+        terminate_signal, timers=None, lanes=None):
     """Waits for events on the event queue and calls the registered functions.
 
     :param function_maps: A list of classes that have inheritted from
@@ -321,10 +916,46 @@ def handle_events(
     :type event_matches_function_map: function
     :param terminate_signal: The signal that, when placed on the event queue,
         causes this function to exit.
+    :param timers: Timers to run in between events.
+    :type timers: :class:`TimerQueue`
+    :param lanes: Dispatch by priority: every waiting event is moved into
+        the lanes before each dispatch. The events in the lanes when the
+        terminate signal arrives are still dispatched.
+    :type lanes: :class:`PriorityLanes`
     """
+    terminating = False
     while True:
         # print("HANDLE: Waiting for events!")
-        event = event_queue.get()
+        if terminating and not lanes:
+            return
+        if lanes:
+            event = None  # there are events waiting already
+        elif timers is None:
+            event = event_queue.get()
+        else:
+            try:
+                event = event_queue.get(timers.timeout())
+            except queue.Empty:
+                timers.run_due()
+                continue
+
+        if lanes is not None:
+            # move every waiting event into its lane, then take the most
+            # urgent one
+            while not terminating:
+                if event is None:
+                    try:
+                        event = event_queue.get(0)
+                    except queue.Empty:
+                        break
+                if event == terminate_signal:
+                    terminating = True  # after the events in the lanes
+                    break
+                lanes.put(event)
+                event = None
+            if not lanes:
+                return  # terminating
+            event = lanes.get()
         # print("HANDLE: It's an event!")
         if event == terminate_signal:
             return
@@ -340,6 +971,9 @@ def handle_events(
         for function in functions:
             function(event)
 
+        if timers is not None:
+            timers.run_due()
+
 
 # def clear_interrupts(port):
 #     """Clears the interrupt flags by 'read'ing the capture register
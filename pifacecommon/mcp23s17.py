@@ -3,9 +3,10 @@ import sys
 from .core import (
     get_bit_mask,
     get_bit_num,
+    pack_pins,
+    unpack_pins,
 )
-from .spi import SPIDevice
-import pifacecommon.interrupts
+from .spi import SPIDevice, SPITransferPlan, tuned_speed_hz
 
 
 # Python 2 support
@@ -55,6 +56,13 @@ INTPOL_LOW = 0x00
 
 LOWER_NIBBLE, UPPER_NIBBLE = range(2)
 
+# SPI clock tuning
+MAX_SPEED_HZ = 10000000  # rated maximum of the MCP23S17
+TUNE_SPEED_STEP = 2
+TUNE_SPEED_MARGIN = 0.75
+TUNE_PATTERNS = (0x55, 0xAA, 0x00, 0xFF, 0x0F, 0xF0)
+TUNE_TRIALS = 4
+
 
 class MCP23S17(SPIDevice):
     """Microchip's MCP23S17: A 16-Bit I/O Expander with Serial Interface.
@@ -87,9 +95,12 @@ class MCP23S17(SPIDevice):
     :attribute: olata/olatb -- The OLAT register provides access to the
                                output latches.
     """
-    def __init__(self, hardware_addr=0, bus=0, chip_select=0, speed_hz=100000):
-        super(MCP23S17, self).__init__(bus, chip_select, speed_hz=speed_hz)
+    def __init__(self, hardware_addr=0, bus=0, chip_select=0, speed_hz=None,
+                 spi_callback=None):
+        super(MCP23S17, self).__init__(
+            bus, chip_select, spi_callback=spi_callback, speed_hz=speed_hz)
         self.hardware_addr = hardware_addr
+        self.read_coalescer = None
 
         self.iodira = MCP23S17Register(IODIRA, self)
         self.iodirb = MCP23S17Register(IODIRB, self)
@@ -129,10 +140,7 @@ class MCP23S17(SPIDevice):
         :param read_write_cmd: Read or write command.
         :type read_write_cmd: int
         """
-        # board_addr_pattern = (self.hardware_addr & 0b111) << 1
-        board_addr_pattern = (self.hardware_addr << 1) & 0xE
-        rw_cmd_pattern = read_write_cmd & 1  # make sure it's just 1 bit long
-        return 0x40 | board_addr_pattern | rw_cmd_pattern
+        return get_spi_control_byte(self.hardware_addr, read_write_cmd)
 
     def read(self, address):
         """Returns the value of the address specified.
@@ -140,6 +148,9 @@ class MCP23S17(SPIDevice):
         :param address: The address to read from.
         :type address: int
         """
+        coalescer = self.read_coalescer
+        if coalescer is not None and address in coalescer.addresses:
+            return coalescer.read(address)
         return self._pyver_read(address)
 
     def _py3read(self, address):
@@ -161,6 +172,8 @@ class MCP23S17(SPIDevice):
         :type address: int
         """
         self._pyver_write(data, address)
+        if self.read_coalescer is not None:
+            self.read_coalescer.invalidate()
 
     def _py3write(self, data, address):
         ctrl_byte = self._get_spi_control_byte(WRITE_CMD)
@@ -174,6 +187,24 @@ class MCP23S17(SPIDevice):
     _pyver_read = _py3read if PY3 else _py2read
     _pyver_write = _py3write if PY3 else _py2write
 
+    def enable_read_coalescing(self, max_staleness=0):
+        """Shares reads of the volatile registers (INTF, INTCAP, GPIO)
+        between threads reading them at the same time (see
+        :class:`pifacecommon.coalesce.ReadCoalescer`).
+
+        :param max_staleness: Seconds a value read can be reused for
+            (INTF only, INTCAP and GPIO reads clear the interrupt).
+        :type max_staleness: float
+        :returns: :class:`pifacecommon.coalesce.ReadCoalescer`
+        """
+        from .coalesce import ReadCoalescer
+        self.read_coalescer = ReadCoalescer(self._pyver_read, max_staleness)
+        return self.read_coalescer
+
+    def disable_read_coalescing(self):
+        """Reads every register from the chip each time."""
+        self.read_coalescer = None
+
     def read_bit(self, bit_num, address):
         """Returns the bit specified from the address.
 
@@ -197,6 +228,8 @@ class MCP23S17(SPIDevice):
         :param address: The address to write to.
         :type address: int
         """
+        if self.metrics is not None:
+            self.metrics.record_read_modify_write(address)
         bit_mask = get_bit_mask(bit_num)
         old_byte = self.read(address)
          # generate the new byte
@@ -208,7 +241,384 @@ class MCP23S17(SPIDevice):
 
     def clear_interrupts(self, port):
         """Clears the interrupt flags by 'read'ing the capture register."""
-        self.read(INTCAPA if port == GPIOA else INTCAPB)
+        # always from the chip, never shared with other readers
+        self._pyver_read(INTCAPA if port == GPIOA else INTCAPB)
+        if self.read_coalescer is not None:
+            self.read_coalescer.invalidate()
+
+    def aread(self, address):
+        """Returns an awaitable for the value of the address specified. The
+        read is sent by this bus's I/O thread, batched with any other queued
+        requests (see :mod:`pifacecommon.busio`).
+
+        :param address: The address to read from.
+        :type address: int
+        """
+        return self._aread(address)
+
+    def awrite(self, data, address):
+        """Returns an awaitable that writes data to the address specified.
+
+        :param data: The data to write.
+        :type data: int
+        :param address: The address to write to.
+        :type address: int
+        """
+        from .busio import WRITE
+        return self._asubmit(WRITE, address, data)
+
+    def aread_bit(self, bit_num, address):
+        """Returns an awaitable for the bit specified from the address."""
+        bit_mask = get_bit_mask(bit_num)
+        return self._aread(address, lambda value: 1 if value & bit_mask else 0)
+
+    def awrite_bit(self, value, bit_num, address):
+        """Returns an awaitable that writes the value given to the bit in the
+        address specified.
+        """
+        bit_mask = get_bit_mask(bit_num)
+        if value:
+            return self.aupdate(address, lambda old_byte: old_byte | bit_mask)
+        else:
+            return self.aupdate(address, lambda old_byte: old_byte & ~bit_mask)
+
+    def aupdate(self, address, function):
+        """Returns an awaitable that reads the address, writes back
+        function(value) and results in the new value. The read and write
+        happen on the I/O thread with no other requests in between.
+
+        :param address: The address to update.
+        :type address: int
+        :param function: Returns the new value from the old value.
+        :type function: function
+        """
+        from .busio import UPDATE
+        return self._asubmit(
+            UPDATE, address, lambda value: function(value) & 0xFF)
+
+    def _aread(self, address, transform=None):
+        from .busio import READ
+        return self._asubmit(READ, address, transform)
+
+    def _asubmit(self, kind, address, argument):
+        import asyncio
+        from .busio import get_bus_io_thread
+        future = get_bus_io_thread(self).submit(kind, self, address, argument)
+        return asyncio.wrap_future(future)
+
+    def read_pins(self, address=GPIOA):
+        """Returns the 16 pins of this chip as one row of
+        :func:`read_pins`.
+        """
+        return read_pins((self,), address)[0]
+
+    def write_pins(self, pins, address=OLATA):
+        """Writes the 16 pins of this chip (see :func:`write_pins`)."""
+        write_pins((self,), (pins,), address)
+
+    def tune_speed(self, max_speed_hz=MAX_SPEED_HZ, step=TUNE_SPEED_STEP,
+                   margin=TUNE_SPEED_MARGIN, address=DEFVALA,
+                   patterns=TUNE_PATTERNS, trials=TUNE_TRIALS, retune=False):
+        """Finds the fastest reliable SPI clock speed for this bus and
+        configures the SPI device to use it.
+
+        Starting at the current speed, the clock is raised by `step` until
+        `max_speed_hz` is reached or the write/readback `patterns` on the
+        scratch register at `address` fail. If a speed failed then the last
+        good speed is reduced by `margin`. The original register value is
+        restored afterwards. The result is cached per bus so other chips on
+        the bus (and later tunes) use it without probing.
+
+        :param max_speed_hz: The fastest speed to try.
+        :type max_speed_hz: int
+        :param step: Multiplier between successive speeds.
+        :type step: float
+        :param margin: Fraction of the last good speed to settle on.
+        :type margin: float
+        :param address: The scratch register to test with.
+        :type address: int
+        :param patterns: The values to write and read back.
+        :type patterns: tuple
+        :param trials: Number of times each pattern is tested per speed.
+        :type trials: int
+        :param retune: Probe again even if a speed is cached for this bus.
+        :type retune: bool
+        :returns: int -- the chosen speed in Hz
+        :raises: ValueError if step is not more than 1
+        """
+        if step <= 1:
+            raise ValueError("The step must be more than 1 (got %s)." % step)
+        bus_key = (self.bus, self.chip_select)
+        if not retune and bus_key in tuned_speed_hz:
+            self.configure(speed_hz=tuned_speed_hz[bus_key])
+            return self.speed_hz
+
+        start_speed_hz = self.speed_hz
+        original_value = self.read(address)
+        good_speed_hz = speed_hz = start_speed_hz
+        failed = False
+        try:
+            while speed_hz < max_speed_hz:
+                speed_hz = min(max(int(speed_hz * step), speed_hz + 1),
+                               max_speed_hz)
+                self.speed_hz = speed_hz
+                if not self._verify_patterns(address, patterns, trials):
+                    failed = True
+                    break
+                good_speed_hz = speed_hz
+        finally:
+            self.speed_hz = start_speed_hz  # stop probing on any error
+
+        if failed:
+            good_speed_hz = max(start_speed_hz, int(good_speed_hz * margin))
+        self.configure(speed_hz=good_speed_hz)
+        self.write(original_value, address)
+        tuned_speed_hz[bus_key] = good_speed_hz
+        return good_speed_hz
+
+    def _verify_patterns(self, address, patterns, trials):
+        """Returns True if each pattern written to the address is read back
+        correctly at the current speed.
+        """
+        write_ctrl = self._get_spi_control_byte(WRITE_CMD)
+        read_ctrl = self._get_spi_control_byte(READ_CMD)
+        read_message = bytes(bytearray((read_ctrl, address, 0)))
+        messages = list()
+        for pattern in tuple(patterns) * trials:
+            messages.append(bytes(bytearray((write_ctrl, address, pattern))))
+            messages.append(read_message)
+        try:
+            replies = self.spisend_many(messages)
+        except IOError:
+            return False  # the driver refused this speed
+        values = [bytearray(reply)[2] for reply in replies[1::2]]
+        return values == list(patterns) * trials
+
+
+def get_spi_control_byte(hardware_addr, read_write_cmd):
+    """Returns the SPI control byte for a hardware address (see
+    :meth:`MCP23S17._get_spi_control_byte`).
+
+    :param hardware_addr: The hardware address of the chip.
+    :type hardware_addr: int
+    :param read_write_cmd: Read or write command.
+    :type read_write_cmd: int
+    """
+    # board_addr_pattern = (hardware_addr & 0b111) << 1
+    board_addr_pattern = (hardware_addr << 1) & 0xE
+    rw_cmd_pattern = read_write_cmd & 1  # make sure it's just 1 bit long
+    return 0x40 | board_addr_pattern | rw_cmd_pattern
+
+
+def send_batched(chip_messages):
+    """Sends messages to many chips using one ioctl per SPI device.
+
+    :param chip_messages: (chip, message) pairs.
+    :type chip_messages: list
+    :returns: list -- the reply to each message, in the same order
+    """
+    devices = dict()  # (bus, chip_select) -> (chip, [message index, ...])
+    for i, (chip, message) in enumerate(chip_messages):
+        device = devices.setdefault(
+            (chip.bus, chip.chip_select), (chip, list()))
+        device[1].append(i)
+
+    replies = [None] * len(chip_messages)
+    for chip, indexes in devices.values():
+        device_replies = chip.spisend_many(
+            [chip_messages[i][1] for i in indexes])
+        for i, reply in zip(indexes, device_replies):
+            replies[i] = reply
+    return replies
+
+
+def read_ports(chips, address=GPIOA, executor=None):
+    """Reads an A/B register pair from many chips in one batch.
+
+    :param chips: The chips to read from.
+    :type chips: list
+    :param address: The address of the A register.
+    :type address: int
+    :param executor: Sends the batch (default: one SPI device at a time).
+    :type executor: :class:`pifacecommon.multibus.MultiBusExecutor`
+    :returns: list -- (port A, port B) values of each chip
+    """
+    # the address pointer moves from the A register to the B register
+    # whether IOCON.SEQOP is set or not
+    chip_messages = [
+        (chip, bytes(bytearray(
+            (chip._get_spi_control_byte(READ_CMD), address, 0, 0))))
+        for chip in chips]
+    send = send_batched if executor is None else executor.send_batched
+    return [tuple(bytearray(reply)[2:4]) for reply in send(chip_messages)]
+
+
+def write_ports(chips, port_values, address=OLATA, previous=None):
+    """Writes an A/B register pair on many chips in one batch. Every chip is
+    written in full unless the values already on the chips are given, then
+    only the registers that change are written.
+
+    :param chips: The chips to write to.
+    :type chips: list
+    :param port_values: (port A, port B) values of each chip.
+    :type port_values: list
+    :param address: The address of the A register.
+    :type address: int
+    :param previous: (port A, port B) values on each chip (e.g. from
+        :func:`read_ports` or the last write).
+    :type previous: list
+    """
+    if previous is None:
+        chip_messages = [
+            (chip, bytes(bytearray(
+                (chip._get_spi_control_byte(WRITE_CMD), address,
+                 port_a, port_b))))
+            for chip, (port_a, port_b) in zip(chips, port_values)]
+    else:
+        chip_messages = list()
+        for chip, (port_a, port_b), (old_a, old_b) in zip(
+                chips, port_values, previous):
+            message = _pair_message(
+                chip, address, old_a | (old_b << 8), port_a | (port_b << 8))
+            if message is not None:
+                chip_messages.append((chip, message))
+    if chip_messages:
+        send_batched(chip_messages)
+
+
+def latch_message(chip, old_value, new_value):
+    """Returns the message that writes the output latches (OLATA bits 0-7,
+    OLATB bits 8-15) that differ between two 16 bit values, or None if
+    none do.
+
+    :param chip: The chip to write to.
+    :type chip: :class:`MCP23S17`
+    :param old_value: The latch values on the chip.
+    :type old_value: int
+    :param new_value: The latch values to write.
+    :type new_value: int
+    :returns: bytes
+    """
+    return _pair_message(chip, OLATA, old_value, new_value)
+
+
+def _pair_message(chip, address, old_value, new_value):
+    """Returns the message that writes the registers of an A/B pair (A bits
+    0-7, B bits 8-15) that differ between two 16 bit values, or None.
+    """
+    changed = (old_value ^ new_value) & 0xFFFF
+    if changed == 0:
+        return None
+    ctrl_byte = chip._get_spi_control_byte(WRITE_CMD)
+    if changed & 0xFF00 == 0:
+        data = (ctrl_byte, address, new_value & 0xFF)
+    elif changed & 0x00FF == 0:
+        data = (ctrl_byte, address + 1, (new_value >> 8) & 0xFF)
+    else:
+        # the address pointer moves from the A register to the B register
+        data = (ctrl_byte, address, new_value & 0xFF,
+                (new_value >> 8) & 0xFF)
+    return bytes(bytearray(data))
+
+
+def read_pins(chips, address=GPIOA):
+    """Reads the 16 pins of many chips in one batch. Returns an
+    (n_chips, 16) boolean array if NumPy is available (see
+    :func:`pifacecommon.core.unpack_pins`).
+
+    :param chips: The chips to read from.
+    :type chips: list
+    :param address: The address of the A register.
+    :type address: int
+    """
+    return unpack_pins(read_ports(chips, address))
+
+
+def write_pins(chips, pins, address=OLATA, previous=None):
+    """Writes the 16 pins of many chips in one batch. Without the previous
+    pin values this is a register pair write per chip, with them only the
+    chips and ports that change are written.
+
+    :param chips: The chips to write to.
+    :type chips: list
+    :param pins: The pin values of each chip, shape (n_chips, 16).
+    :type pins: :py:class:`numpy.ndarray` or list
+    :param address: The address of the A register.
+    :type address: int
+    :param previous: The pin values on the chips, shape (n_chips, 16)
+        (e.g. from :func:`read_pins` or the last write).
+    :type previous: :py:class:`numpy.ndarray` or list
+    """
+    if previous is not None:
+        previous = pack_pins(previous)
+    write_ports(chips, pack_pins(pins), address, previous)
+
+
+def prepare(operations):
+    """Compiles register operations on chips sharing an SPI device into a
+    :class:`MCP23S17Plan` which sends them all in one ioctl each time it is
+    run.
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=i)
+    ...          for i in range(4)]
+    >>> plan = pifacecommon.mcp23s17.prepare(
+    ...     [(READ_CMD, chip, GPIOA) for chip in chips] +
+    ...     [(WRITE_CMD, chip, OLATB) for chip in chips])
+    >>> results = plan.run((0x01, 0x02, 0x04, 0x08))
+    >>> results[0]  # GPIOA of the first chip
+    255
+
+    :param operations: (READ_CMD/WRITE_CMD, chip, address) tuples.
+    :type operations: list
+    :returns: :class:`MCP23S17Plan`
+    :raises: ValueError
+    """
+    devices = set((chip.bus, chip.chip_select)
+                  for read_write_cmd, chip, address in operations)
+    if len(devices) != 1:
+        raise ValueError(
+            "Operations must all be on the same SPI device, not %s." %
+            sorted(devices))
+
+    messages = [
+        bytes(bytearray(
+            (chip._get_spi_control_byte(read_write_cmd), address, 0)))
+        for read_write_cmd, chip, address in operations]
+    write_indexes = [
+        i for i, (read_write_cmd, chip, address) in enumerate(operations)
+        if read_write_cmd == WRITE_CMD]
+    return MCP23S17Plan(
+        SPITransferPlan(operations[0][1], messages), write_indexes)
+
+
+class MCP23S17Plan(object):
+    """Register operations prepared by :func:`prepare`."""
+    def __init__(self, transfer_plan, write_indexes):
+        self.transfer_plan = transfer_plan
+        self.write_indexes = write_indexes
+        # every message is (control byte, address, data)
+        self.data = transfer_plan.tx[2::3]
+        self.results = transfer_plan.rx[2::3]
+
+    def run(self, values=()):
+        """Sends the operations.
+
+        :param values: The data for each write operation, in order. Writes
+            without a value send the same data as last time.
+        :type values: list
+        :returns: memoryview -- the data byte of each operation, in order
+            (reused by the next run)
+        """
+        for i, value in zip(self.write_indexes, values):
+            self.data[i] = value
+        self.transfer_plan.run()
+        return self.results
+
+
+def _record_read_modify_write(register):
+    metrics = getattr(register.chip, 'metrics', None)
+    if metrics is not None:
+        metrics.record_read_modify_write(register.address)
 
 
 class MCP23S17RegisterBase(object):
@@ -237,6 +647,14 @@ class MCP23S17Register(MCP23S17RegisterBase):
     def value(self, v):
         self.chip.write(v, self.address)
 
+    def aget(self):
+        """Returns an awaitable for the register value."""
+        return self.chip.aread(self.address)
+
+    def aset(self, v):
+        """Returns an awaitable that sets the register value."""
+        return self.chip.awrite(v, self.address)
+
     def all_high(self):
         self.value = 0xFF
 
@@ -247,6 +665,7 @@ class MCP23S17Register(MCP23S17RegisterBase):
     all_off = all_low
 
     def toggle(self):
+        _record_read_modify_write(self)
         self.value = 0xFF ^ self.value
 
 
@@ -271,6 +690,12 @@ class MCP23S17RegisterNeg(MCP23S17Register):
     def value(self, v):
         self.chip.write(0xFF ^ v, self.address)
 
+    def aget(self):
+        return self.chip._aread(self.address, lambda value: 0xFF ^ value)
+
+    def aset(self, v):
+        return self.chip.awrite(0xFF ^ v, self.address)
+
 
 class MCP23S17RegisterNibble(MCP23S17RegisterBase):
     """An 4-bit nibble inside a register inside an MCP23S17."""
@@ -291,6 +716,7 @@ class MCP23S17RegisterNibble(MCP23S17RegisterBase):
 
     @value.setter
     def value(self, v):
+        _record_read_modify_write(self)
         register_value = self.chip.read(self.address)
         if self.nibble == LOWER_NIBBLE:
             register_value &= 0xF0  # clear
@@ -300,6 +726,22 @@ class MCP23S17RegisterNibble(MCP23S17RegisterBase):
             register_value ^= ((v << 4) & 0xF0)  # set
         self.chip.write(register_value, self.address)
 
+    def aget(self):
+        """Returns an awaitable for the nibble value."""
+        if self.nibble == LOWER_NIBBLE:
+            return self.chip._aread(self.address, lambda value: value & 0xF)
+        else:
+            return self.chip._aread(self.address, lambda value: value >> 4)
+
+    def aset(self, v):
+        """Returns an awaitable that sets the nibble value."""
+        if self.nibble == LOWER_NIBBLE:
+            return self.chip.aupdate(
+                self.address, lambda value: (value & 0xF0) | (v & 0x0F))
+        else:
+            return self.chip.aupdate(
+                self.address, lambda value: (value & 0x0F) | ((v << 4) & 0xF0))
+
     def all_high(self):
         self.value = 0xF
 
@@ -310,7 +752,7 @@ class MCP23S17RegisterNibble(MCP23S17RegisterBase):
     all_off = all_low
 
     def toggle(self):
-        self.value = 0xF ^ self.value
+        self.value = 0xF ^ self.value  # counted by the setter
 
 
 class MCP23S17RegisterNibbleNeg(MCP23S17RegisterNibble):
@@ -333,6 +775,7 @@ class MCP23S17RegisterNibbleNeg(MCP23S17RegisterNibble):
 
     @value.setter
     def value(self, v):
+        _record_read_modify_write(self)
         register_value = self.chip.read(self.address)
         if self.nibble == LOWER_NIBBLE:
             register_value &= 0xF0  # clear
@@ -342,6 +785,17 @@ class MCP23S17RegisterNibbleNeg(MCP23S17RegisterNibble):
             register_value ^= ((v << 4) & 0xF0 ^ 0xF0)  # set
         self.chip.write(register_value, self.address)
 
+    def aget(self):
+        if self.nibble == LOWER_NIBBLE:
+            return self.chip._aread(
+                self.address, lambda value: 0xF ^ (value & 0xF))
+        else:
+            return self.chip._aread(
+                self.address, lambda value: 0xF ^ (value >> 4))
+
+    def aset(self, v):
+        return super(MCP23S17RegisterNibbleNeg, self).aset(0xF ^ v)
+
 
 class MCP23S17RegisterBit(MCP23S17RegisterBase):
     """A bit inside register inside an MCP23S17."""
@@ -357,6 +811,14 @@ class MCP23S17RegisterBit(MCP23S17RegisterBase):
     def value(self, v):
         self.chip.write_bit(v, self.bit_num, self.address)
 
+    def aget(self):
+        """Returns an awaitable for the bit value."""
+        return self.chip.aread_bit(self.bit_num, self.address)
+
+    def aset(self, v):
+        """Returns an awaitable that sets the bit value."""
+        return self.chip.awrite_bit(v, self.bit_num, self.address)
+
     def set_high(self):
         self.value = 1
 
@@ -382,3 +844,11 @@ class MCP23S17RegisterBitNeg(MCP23S17RegisterBit):
     @value.setter
     def value(self, v):
         self.chip.write_bit(v ^ 1, self.bit_num, self.address)
+
+    def aget(self):
+        bit_mask = get_bit_mask(self.bit_num)
+        return self.chip._aread(
+            self.address, lambda value: 0 if value & bit_mask else 1)
+
+    def aset(self, v):
+        return self.chip.awrite_bit(v ^ 1, self.bit_num, self.address)
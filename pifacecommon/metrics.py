@@ -0,0 +1,89 @@
+import threading
+from .core import monotonic
+
+
+LATENCY_BUCKETS = 24  # powers of two microseconds, up to ~16s
+
+
+class SPIMetrics(object):
+    """Counts the SPI traffic of a device: ioctls, transfers and bytes, the
+    same per register address, read-modify-writes per address and a
+    histogram of ioctl latency. Latency bucket i counts ioctls that took
+    between 2**i and 2**(i+1) microseconds (measured on a monotonic clock).
+
+    Register addresses are taken from the second byte of each message
+    (which is where the MCP23S17 expects them) and reads from the bottom bit
+    of the first.
+
+    >>> chip = pifacecommon.mcp23s17.MCP23S17()
+    >>> metrics = chip.enable_metrics()
+    >>> chip.gpioa.bits[0].value = 1
+    >>> metrics.snapshot()['registers'][pifacecommon.mcp23s17.GPIOA]
+    {'reads': 1, 'writes': 1, 'bytes': 6, 'read_modify_writes': 1}
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero."""
+        self.ioctls = 0
+        self.transfers = 0
+        self.bytes = 0
+        self.latency_histogram = [0] * LATENCY_BUCKETS
+        # address -> [reads, writes, bytes, read-modify-writes]
+        self.registers = dict()
+
+    def record_ioctl(self, messages, start_time):
+        """Records an ioctl that sent messages and started at start_time
+        (from :func:`pifacecommon.core.monotonic`).
+        """
+        latency_us = int((monotonic() - start_time) * 1000000)
+        bucket = min(latency_us.bit_length(), LATENCY_BUCKETS) - 1
+        with self._lock:
+            self.latency_histogram[max(bucket, 0)] += 1
+            self.ioctls += 1
+            self.transfers += len(messages)
+            for message in messages:
+                length = len(message)
+                self.bytes += length
+                if length < 2:
+                    continue
+                message = bytearray(message[:2])
+                counts = self._register(message[1])
+                counts[0 if message[0] & 1 else 1] += 1
+                counts[2] += length
+
+    def record_read_modify_write(self, address):
+        """Records a read-modify-write of a register."""
+        with self._lock:
+            self._register(address)[3] += 1
+
+    def snapshot(self):
+        """Returns a copy of the counters.
+
+        :returns: dict
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            'ioctls': self.ioctls,
+            'transfers': self.transfers,
+            'bytes': self.bytes,
+            'latency_histogram_us': list(self.latency_histogram),
+            'registers': dict(
+                (address, {'reads': reads,
+                           'writes': writes,
+                           'bytes': byte_count,
+                           'read_modify_writes': read_modify_writes})
+                for address, (reads, writes, byte_count, read_modify_writes)
+                in self.registers.items()),
+        }
+
+    def _register(self, address):
+        counts = self.registers.get(address)
+        if counts is None:
+            counts = self.registers[address] = [0, 0, 0, 0]
+        return counts
@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import Future
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+from .mcp23s17 import GPIOA, read_ports
+
+
+class DeviceWorker(object):
+    """A thread that sends batches of messages on one SPI device."""
+    def __init__(self, device):
+        """
+        :param device: The SPI device to send on.
+        :type device: :class:`pifacecommon.spi.SPIDevice`
+        """
+        self.device = device
+        self.batches = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, messages):
+        """Queues messages to be sent in one ioctl.
+
+        :returns: :py:class:`concurrent.futures.Future` -- the replies
+        """
+        future = Future()
+        self.batches.put((messages, future))
+        return future
+
+    def stop(self):
+        self.batches.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            batch = self.batches.get()
+            if batch is None:
+                return
+            messages, future = batch
+            try:
+                future.set_result(self.device.spisend_many(messages))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class MultiBusExecutor(object):
+    """Runs batched operations on several SPI devices (e.g. spidev0.0,
+    spidev0.1 and spidev1.x) at the same time. Each device has its own
+    worker thread, and since ioctl releases the GIL the transfers on
+    different buses overlap. The results are merged back into one list.
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=h, bus=b,
+    ...                                         chip_select=c)
+    ...          for b, c in ((0, 0), (0, 1), (1, 0)) for h in range(4)]
+    >>> executor = pifacecommon.multibus.MultiBusExecutor()
+    >>> snapshot = executor.read_ports(chips)
+    """
+    def __init__(self):
+        self.workers = dict()  # (bus, chip_select) -> DeviceWorker
+        self._lock = threading.Lock()
+
+    def send_batched(self, chip_messages):
+        """Sends messages to many chips with one ioctl per SPI device, all
+        devices in parallel.
+
+        :param chip_messages: (chip, message) pairs.
+        :type chip_messages: list
+        :returns: list -- the reply to each message, in the same order
+        """
+        devices = dict()  # (bus, chip_select) -> (chip, [message index, ...])
+        for i, (chip, message) in enumerate(chip_messages):
+            device = devices.setdefault(
+                (chip.bus, chip.chip_select), (chip, list()))
+            device[1].append(i)
+
+        futures = list()
+        for key, (chip, indexes) in devices.items():
+            worker = self._worker(key, chip)
+            futures.append((indexes, worker.submit(
+                [chip_messages[i][1] for i in indexes])))
+
+        replies = [None] * len(chip_messages)
+        for indexes, future in futures:
+            for i, reply in zip(indexes, future.result()):
+                replies[i] = reply
+        return replies
+
+    def read_ports(self, chips, address=GPIOA):
+        """Reads an A/B register pair from every chip, all SPI devices in
+        parallel (see :func:`pifacecommon.mcp23s17.read_ports`).
+
+        :returns: list -- (port A, port B) values of each chip
+        """
+        return read_ports(chips, address, self)
+
+    def shutdown(self):
+        """Stops the worker threads."""
+        with self._lock:
+            for worker in self.workers.values():
+                worker.stop()
+            self.workers = dict()
+
+    def _worker(self, key, chip):
+        with self._lock:
+            if key not in self.workers:
+                self.workers[key] = DeviceWorker(chip)
+            return self.workers[key]
@@ -0,0 +1,155 @@
+import time
+from .interrupts import IODIR_ON, IODIR_BOTH, DEFAULT_SETTLE_TIME
+
+
+class PatternEvent(object):
+    """A matched pattern, with the interrupt events that made it up."""
+    def __init__(self, pattern, events, timestamp):
+        self.pattern = pattern
+        self.events = events
+        self.chip = events[-1].chip
+        self.timestamp = timestamp
+
+    def __str__(self):
+        s = "pattern:   {pattern}\n" \
+            "pin_nums:  {pin_nums}\n" \
+            "chip:      {chip}\n" \
+            "timestamp: {timestamp}"
+        return s.format(pattern=type(self.pattern).__name__,
+                        pin_nums=[event.pin_num for event in self.events],
+                        chip=self.chip,
+                        timestamp=self.timestamp)
+
+
+class Pattern(object):
+    """A state machine over the events of some pins.
+    (This is an abstract class, you must implement a SomethingPattern with
+    a feed(event, matcher) method that moves the state machine on with an
+    event on one of its pins and calls matcher.emit when it has matched).
+    """
+    def __init__(self, pin_nums, direction=IODIR_ON):
+        self.pin_nums = list(pin_nums)
+        self.direction = direction
+
+    def _pressed(self, event):
+        return event.direction == self.direction
+
+
+class LongPress(Pattern):
+    """A pin held in the given direction for `duration` seconds."""
+    def __init__(self, pin_num, duration, direction=IODIR_ON):
+        super(LongPress, self).__init__((pin_num,), direction)
+        self.duration = duration
+        self.timer = None
+
+    def feed(self, event, matcher):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self._pressed(event):
+            held_for = time.time() - event.timestamp
+            self.timer = matcher.timers.call_later(
+                max(0, self.duration - held_for), self._held, event, matcher)
+
+    def _held(self, event, matcher):
+        self.timer = None
+        matcher.emit(self, [event])
+
+
+class Sequence(Pattern):
+    """Pins pressed one after the other, all within `within` seconds of the
+    first.
+    """
+    def __init__(self, pin_nums, within, direction=IODIR_ON):
+        super(Sequence, self).__init__(pin_nums, direction)
+        self.within = within
+        self.events = list()
+
+    def feed(self, event, matcher):
+        if not self._pressed(event):
+            return
+        if self.events and \
+                event.timestamp - self.events[0].timestamp > self.within:
+            self.events = list()
+
+        if event.pin_num == self.pin_nums[len(self.events)]:
+            self.events.append(event)
+        elif event.pin_num == self.pin_nums[0]:
+            self.events = [event]
+        else:
+            self.events = list()
+
+        if len(self.events) == len(self.pin_nums):
+            events, self.events = self.events, list()
+            matcher.emit(self, events)
+
+
+class Chord(Pattern):
+    """Pins pressed together: all of them pressed within `within` seconds of
+    each other and none released in between.
+    """
+    def __init__(self, pin_nums, within, direction=IODIR_ON):
+        super(Chord, self).__init__(pin_nums, direction)
+        self.within = within
+        self.presses = dict()  # pin num -> press event
+
+    def feed(self, event, matcher):
+        if not self._pressed(event):
+            self.presses.pop(event.pin_num, None)
+            return
+        self.presses[event.pin_num] = event
+        for pin_num, press in list(self.presses.items()):
+            if event.timestamp - press.timestamp > self.within:
+                del self.presses[pin_num]
+
+        if len(self.presses) == len(self.pin_nums):
+            events = sorted(self.presses.values(),
+                            key=lambda press: press.timestamp)
+            self.presses = dict()
+            matcher.emit(self, events)
+
+
+class PatternMatcher(object):
+    """Matches patterns against the events of a
+    :class:`pifacecommon.interrupts.PortEventListener`. The patterns run on
+    the listener's dispatcher thread and share its timers. Register patterns
+    before activating the listener.
+
+    >>> matcher = pifacecommon.patterns.PatternMatcher(listener)
+    >>> matcher.register(pifacecommon.patterns.LongPress(0, 2), print)
+    >>> matcher.register(pifacecommon.patterns.Sequence((0, 1), 0.5), print)
+    >>> matcher.register(pifacecommon.patterns.Chord((0, 1), 0.1), print)
+    >>> listener.activate()
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self.timers = listener.timers
+        self.pin_patterns = dict()  # pin num -> patterns using it
+        self.callbacks = dict()  # pattern -> callback
+
+    def register(self, pattern, callback, settle_time=DEFAULT_SETTLE_TIME):
+        """Calls callback with a :class:`PatternEvent` each time the pattern
+        is matched.
+
+        :param pattern: The pattern.
+        :type pattern: :class:`Pattern`
+        :param callback: The function to run when the pattern is matched.
+        :type callback: function
+        :param settle_time: Debounce time of the pattern's pins.
+        :type settle_time: float
+        """
+        self.callbacks[pattern] = callback
+        for pin_num in pattern.pin_nums:
+            if pin_num not in self.pin_patterns:
+                self.pin_patterns[pin_num] = list()
+                self.listener.register(
+                    pin_num, IODIR_BOTH, self.handle_event, settle_time)
+            self.pin_patterns[pin_num].append(pattern)
+
+    def handle_event(self, event):
+        """Feeds an event to the patterns using its pin."""
+        for pattern in self.pin_patterns.get(event.pin_num, ()):
+            pattern.feed(event, self)
+
+    def emit(self, pattern, events):
+        self.callbacks[pattern](PatternEvent(pattern, events, time.time()))
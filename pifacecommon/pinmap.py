@@ -0,0 +1,156 @@
+from .core import get_bit_mask
+from .mcp23s17 import READ_CMD, WRITE_CMD, OLATA, send_batched
+
+
+DEFAULT_PIN_NAME = "out%d"
+
+
+class PinMap(object):
+    """Names for the pins of many MCP23S17 chips (such as
+    "rack3/board5/out12") and a planner that sets many of them at once.
+
+    :meth:`set_many` groups the new values by chip and register, reads the
+    registers it doesn't know yet in one batch, and sends only the
+    registers that change in one batch, with the A and B registers of a
+    chip in a single message where both change. Register values are
+    remembered between calls, so the registers must not be written by
+    anything else (or :meth:`invalidate` them after they have been).
+
+    >>> pins = pifacecommon.pinmap.PinMap()
+    >>> for rack in range(4):
+    ...     for board in range(8):
+    ...         chip = pifacecommon.mcp23s17.MCP23S17(
+    ...             hardware_addr=board, chip_select=rack % 2, bus=rack // 2)
+    ...         pins.add_chip("rack%d/board%d" % (rack, board), chip)
+    >>> pins.set_many({"rack3/board5/out12": 1, "rack0/board1/out0": 0})
+    2
+    """
+    def __init__(self):
+        self.pins = dict()  # name -> (chip, address, bit mask)
+        self.shadow = dict()  # (bus, chip_select, hardware_addr, address)
+        #                        -> register value
+
+    def add(self, name, chip, pin_num, address=OLATA):
+        """Names a pin.
+
+        :param name: The pin's name.
+        :type name: str
+        :param chip: The chip the pin is on.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param pin_num: The pin number (0-15, 8-15 are on the B register).
+        :type pin_num: int
+        :param address: The address of the A register.
+        :type address: int
+        """
+        self.pins[name] = (chip, address + pin_num // 8,
+                           get_bit_mask(pin_num % 8))
+
+    def add_chip(self, prefix, chip, address=OLATA,
+                 pin_name=DEFAULT_PIN_NAME):
+        """Names all 16 pins of a chip prefix/out0 to prefix/out15."""
+        for pin_num in range(16):
+            self.add("%s/%s" % (prefix, pin_name % pin_num),
+                     chip, pin_num, address)
+
+    def set(self, name, value):
+        """Sets one pin (see :meth:`set_many`)."""
+        return self.set_many({name: value})
+
+    def set_many(self, values):
+        """Sets many pins with as few SPI messages as possible.
+
+        :param values: Pin name -> value (0/1).
+        :type values: dict
+        :returns: int -- the number of messages written
+        """
+        # register key -> [chip, address, bits to set, bits to clear]
+        updates = dict()
+        for name, value in values.items():
+            chip, address, bit_mask = self.pins[name]
+            key = (chip.bus, chip.chip_select, chip.hardware_addr, address)
+            update = updates.get(key)
+            if update is None:
+                update = updates[key] = [chip, address, 0, 0]
+            if value:
+                update[2] |= bit_mask
+                update[3] &= ~bit_mask
+            else:
+                update[3] |= bit_mask
+                update[2] &= ~bit_mask
+
+        unknown = [key for key in updates if key not in self.shadow]
+        if unknown:
+            self._read(dict((key, updates[key][:2]) for key in unknown))
+
+        # chip key -> (chip, {address: new value}) of changed registers
+        changed = dict()
+        new_values = dict()
+        for key, (chip, address, set_bits, clear_bits) in updates.items():
+            old_value = self.shadow[key]
+            new_value = (old_value & ~clear_bits) | set_bits
+            if new_value != old_value:
+                new_values[key] = new_value
+                changed.setdefault(key[:3], (chip, dict()))[1][address] = \
+                    new_value
+
+        chip_messages = list()
+        for chip, registers in changed.values():
+            ctrl_byte = chip._get_spi_control_byte(WRITE_CMD)
+            for address, data in _pair_up(registers):
+                chip_messages.append(
+                    (chip, bytes(bytearray((ctrl_byte, address) + data))))
+        if chip_messages:
+            send_batched(chip_messages)
+        # only once the chips have them
+        self.shadow.update(new_values)
+        return len(chip_messages)
+
+    def invalidate(self, chip=None):
+        """Forgets the register values of a chip (default: all chips), so
+        they are read again before the next change.
+        """
+        if chip is None:
+            self.shadow = dict()
+            return
+        chip_key = (chip.bus, chip.chip_select, chip.hardware_addr)
+        for key in list(self.shadow):
+            if key[:3] == chip_key:
+                del self.shadow[key]
+
+    def _read(self, registers):
+        """Reads registers ({key: (chip, address)}) into the shadow in one
+        batch.
+        """
+        chips = dict()  # chip key -> (chip, {address: register key})
+        for key, (chip, address) in registers.items():
+            chips.setdefault(key[:3], (chip, dict()))[1][address] = key
+
+        chip_messages = list()
+        message_keys = list()
+        for chip, addresses in chips.values():
+            ctrl_byte = chip._get_spi_control_byte(READ_CMD)
+            for address, data in _pair_up(dict.fromkeys(addresses, 0)):
+                chip_messages.append(
+                    (chip, bytes(bytearray((ctrl_byte, address) + data))))
+                message_keys.append([addresses.get(address + i)
+                                     for i in range(len(data))])
+        for keys, reply in zip(message_keys, send_batched(chip_messages)):
+            for key, value in zip(keys, bytearray(reply)[2:]):
+                self.shadow[key] = value
+
+
+def _pair_up(registers):
+    """Returns (address, data) for each message needed to access registers
+    ({address: value}). A and B registers are accessed together since the
+    address pointer moves from A to B whether IOCON.SEQOP is set or not.
+    """
+    messages = list()
+    for address in sorted(registers):
+        if address % 2 == 1 and address - 1 in registers:
+            continue  # sent with its A register
+        if address % 2 == 0 and address + 1 in registers:
+            messages.append(
+                (address, (registers[address], registers[address + 1])))
+        else:
+            messages.append((address, (registers[address],)))
+    return messages
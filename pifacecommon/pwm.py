@@ -0,0 +1,233 @@
+import threading
+from .core import monotonic, get_bit_mask
+from .mcp23s17 import OLATA, latch_message, read_ports
+
+
+DEFAULT_TICK_HZ = 1000
+# longest planned sequence, frequencies that don't divide evenly into this
+# are approximated at the end of each sequence
+MAX_SEQUENCE_TICKS = 10000
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+class PWMChannel(object):
+    """The duty cycle and frequency of one output pin."""
+    def __init__(self, duty_cycle, frequency):
+        self.duty_cycle = duty_cycle
+        self.frequency = frequency
+
+    def ticks(self, tick_hz):
+        """Returns (period, on) lengths of this channel in ticks."""
+        period = max(1, int(round(float(tick_hz) / self.frequency)))
+        on = int(round(self.duty_cycle * period))
+        return period, min(max(on, 0), period)
+
+
+class PWMScheduler(object):
+    """Drives software PWM and blinking on the 16 outputs (OLATA bits 0-7,
+    OLATB bits 8-15) of many MCP23S17 chips from a single thread.
+
+    The combined OLATA/OLATB values of every chip are planned for a whole
+    sequence when a channel changes. Each tick then sends the precomputed
+    writes for that tick in one ioctl per SPI device, so the cost of a tick
+    does not depend on the number of pins. Only chips with a driven pin are
+    written to, and only when one of their outputs changes. The other pins
+    on those chips keep the latch values they had when the plan started
+    (so change them between plans, not during one), and a pin that is no
+    longer driven is set back to its value from before it was driven.
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=i)
+    ...          for i in range(4)]
+    >>> pwm = pifacecommon.pwm.PWMScheduler(chips)
+    >>> pwm.set(chips[0], 3, duty_cycle=0.25, frequency=100)
+    >>> pwm.blink(chips[2], 12, frequency=2)
+    >>> pwm.start()
+    """
+    def __init__(self, chips, tick_hz=DEFAULT_TICK_HZ,
+                 max_sequence_ticks=MAX_SEQUENCE_TICKS):
+        """
+        :param chips: The chips to drive.
+        :type chips: list of :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param tick_hz: Number of ticks per second.
+        :type tick_hz: int
+        :param max_sequence_ticks: Longest sequence to plan.
+        :type max_sequence_ticks: int
+        """
+        self.chips = list(chips)
+        self.tick_hz = tick_hz
+        self.max_sequence_ticks = max_sequence_ticks
+        self.channels = dict()  # (chip index, pin num) -> PWMChannel
+        # (chip index, pin num) -> bit value from before the pin was driven
+        self.initial_values = dict()
+        self.frames = None
+        self._changed = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set(self, chip, pin_num, duty_cycle, frequency):
+        """Drives a pin with the given duty cycle and frequency.
+
+        :param chip: The chip the pin is on.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param pin_num: The pin number (0-15).
+        :type pin_num: int
+        :param duty_cycle: Fraction of each period the pin is high (0-1).
+        :type duty_cycle: float
+        :param frequency: Periods per second.
+        :type frequency: float
+        """
+        key = (self.chips.index(chip), pin_num)
+        with self._lock:
+            channel = self.channels.get(key)
+            if (channel is not None and channel.duty_cycle == duty_cycle and
+                    channel.frequency == frequency):
+                return
+            self.channels[key] = PWMChannel(duty_cycle, frequency)
+            self._changed = True
+
+    def blink(self, chip, pin_num, frequency):
+        """Blinks a pin on and off at the given frequency."""
+        self.set(chip, pin_num, 0.5, frequency)
+
+    def clear(self, chip, pin_num):
+        """Stops driving a pin. It is set back to its value from before it
+        was driven.
+        """
+        key = (self.chips.index(chip), pin_num)
+        with self._lock:
+            if self.channels.pop(key, None) is not None:
+                self._changed = True
+
+    def plan(self):
+        """Plans the channels as they are now. Returns (sync, frames) where
+        sync is the frame that starts the plan and frames are the frames of
+        one sequence, which repeats until the next plan. Each frame is a
+        list of (chip, messages) pairs, one for each SPI device with an
+        output that changes on that tick.
+        """
+        with self._lock:
+            channels = dict(self.channels)
+            self._changed = False
+        return self._plan(channels)
+
+    def _plan(self, channels):
+        # read the latches of every chip that has a pin to drive or to set
+        # back, so the writes keep the current values of the other pins
+        released = [key for key in self.initial_values if key not in channels]
+        chip_indexes = sorted(set(
+            chip_index for chip_index, pin_num in list(channels) + released))
+        base_values = dict()
+        if chip_indexes:
+            latches = read_ports([self.chips[i] for i in chip_indexes], OLATA)
+            for chip_index, (port_a, port_b) in zip(chip_indexes, latches):
+                base_values[chip_index] = port_a | (port_b << 8)
+        for chip_index, pin_num in channels:
+            if (chip_index, pin_num) not in self.initial_values:
+                self.initial_values[chip_index, pin_num] = \
+                    base_values[chip_index] & get_bit_mask(pin_num)
+        start_values = dict(base_values)
+        for chip_index, pin_num in released:
+            start_values[chip_index] = \
+                (start_values[chip_index] & ~get_bit_mask(pin_num)) | \
+                self.initial_values.pop((chip_index, pin_num))
+
+        ticks = dict((key, channel.ticks(self.tick_hz))
+                     for key, channel in channels.items())
+        length = 1
+        for period, on in ticks.values():
+            length = length * period // _gcd(length, period)
+            if length > self.max_sequence_ticks:
+                length = self.max_sequence_ticks
+                break
+
+        # 16 bit latch values of each chip on each tick
+        values = dict((chip_index, [start] * length)
+                      for chip_index, start in start_values.items())
+        for (chip_index, pin_num), (period, on) in ticks.items():
+            mask = get_bit_mask(pin_num)
+            chip_values = values[chip_index]
+            for tick in range(length):
+                if tick % period < on:
+                    chip_values[tick] |= mask
+                else:
+                    chip_values[tick] &= ~mask
+
+        # the sync frame takes the outputs to the first tick, which is then
+        # reached again from the last tick of each sequence
+        sync = _frame(
+            (self.chips[chip_index],
+             latch_message(self.chips[chip_index], base_values[chip_index],
+                            chip_values[0]))
+            for chip_index, chip_values in values.items())
+        frames = [_frame((self.chips[chip_index],
+                          latch_message(self.chips[chip_index],
+                                         chip_values[tick - 1],
+                                         chip_values[tick]))
+                         for chip_index, chip_values in values.items())
+                  for tick in range(length)]
+        return sync, frames
+
+    def start(self):
+        """Starts driving the outputs from a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops driving the outputs and sets them back to their values
+        from before they were driven.
+        """
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._changed = True  # plan again when restarted
+        sync, frames = self._plan(dict())
+        _send(sync)
+
+    def _run(self):
+        tick_length = 1.0 / self.tick_hz
+        frames = None
+        position = 0
+        next_tick = monotonic()
+        while not self._stop.is_set():
+            if frames is None or self._changed:
+                frame, frames = self.plan()
+                self.frames = frames
+                position = 0  # the sync frame stands in for the first tick
+            else:
+                frame = frames[position]
+            _send(frame)
+            position = (position + 1) % len(frames)
+
+            next_tick += tick_length
+            delay = next_tick - monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            elif delay < -len(frames) * tick_length:
+                next_tick = monotonic()  # too far behind, don't catch up
+
+
+def _frame(chip_messages):
+    """Returns the (chip, messages) pair of each SPI device for the
+    messages that are not None.
+    """
+    devices = dict()  # (bus, chip_select) -> (chip, messages)
+    for chip, message in chip_messages:
+        if message is None:
+            continue
+        device = devices.setdefault(
+            (chip.bus, chip.chip_select), (chip, list()))
+        device[1].append(message)
+    return list(devices.values())
+
+
+def _send(frame):
+    for chip, messages in frame:
+        chip.spisend_many(messages)
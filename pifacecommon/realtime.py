@@ -0,0 +1,93 @@
+import os
+import ctypes
+import ctypes.util
+import warnings
+
+
+SCHED_OTHER = getattr(os, 'SCHED_OTHER', 0)
+SCHED_FIFO = getattr(os, 'SCHED_FIFO', 1)
+SCHED_RR = getattr(os, 'SCHED_RR', 2)
+DEFAULT_PRIORITY = 50  # of 1-99, above most kernel threads' defaults
+
+# mlockall flags
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+class RealtimeWarning(RuntimeWarning):
+    pass
+
+
+class RealtimeOptions(object):
+    """Real-time scheduling options for a thread: a SCHED_FIFO or SCHED_RR
+    priority, CPU affinity and locking the process's memory (mlockall) so
+    that it is never paged out.
+
+    These usually need root (or CAP_SYS_NICE/CAP_IPC_LOCK, or an rtprio
+    limit). Anything that can't be applied is skipped with a
+    :class:`RealtimeWarning`.
+
+    >>> options = pifacecommon.realtime.RealtimeOptions(
+    ...     priority=80, cpus=(3,), lock_memory=True)
+    >>> listener = pifacecommon.interrupts.PortEventListener(
+    ...     port, chip, detector_realtime=options,
+    ...     dispatcher_realtime=options)
+    """
+    def __init__(self, policy=SCHED_FIFO, priority=DEFAULT_PRIORITY,
+                 cpus=None, lock_memory=False):
+        """
+        :param policy: SCHED_FIFO, SCHED_RR or None to leave it unchanged.
+        :type policy: int
+        :param priority: The real-time priority (1-99).
+        :type priority: int
+        :param cpus: The CPUs to run on (default: unchanged).
+        :type cpus: list
+        :param lock_memory: Lock the process's memory.
+        :type lock_memory: bool
+        """
+        self.policy = policy
+        self.priority = priority
+        self.cpus = cpus
+        self.lock_memory = lock_memory
+
+    def apply(self):
+        """Applies the options to the calling thread (memory locking
+        applies to the whole process).
+
+        :returns: bool -- True if every option was applied
+        """
+        applied = True
+        if self.policy is not None:
+            try:
+                os.sched_setscheduler(
+                    0, self.policy, os.sched_param(self.priority))
+            except (AttributeError, OSError) as e:
+                applied = _warn("Could not set scheduling policy", e)
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except (AttributeError, OSError) as e:
+                applied = _warn("Could not set CPU affinity", e)
+        if self.lock_memory:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                   use_errno=True)
+                if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno))
+            except (AttributeError, OSError) as e:
+                applied = _warn("Could not lock memory", e)
+        return applied
+
+
+def run_with(options, function, *args):
+    """Applies the options to the calling thread then calls function(*args).
+    Used as the target of threads and processes.
+    """
+    options.apply()
+    return function(*args)
+
+
+def _warn(message, error):
+    warnings.warn("%s (%s)." % (message, error), RealtimeWarning)
+    return False
@@ -0,0 +1,213 @@
+from .core import get_bit_mask
+from .mcp23s17 import (
+    MCP23S17Register,
+    READ_CMD,
+    IODIRA,
+    IODIRB,
+    IPOLA,
+    IPOLB,
+    GPINTENA,
+    GPINTENB,
+    DEFVALA,
+    DEFVALB,
+    INTCONA,
+    INTCONB,
+    IOCON,
+    GPPUA,
+    GPPUB,
+    INTFA,
+    INTFB,
+    INTCAPA,
+    INTCAPB,
+    GPIOA,
+    GPIOB,
+    OLATA,
+    OLATB,
+    send_batched,
+)
+
+
+NUM_REGISTERS = 0x16
+
+# the register attribute names of MCP23S17
+REGISTER_ADDRESSES = {
+    'iodira': IODIRA, 'iodirb': IODIRB,
+    'ipola': IPOLA, 'ipolb': IPOLB,
+    'gpintena': GPINTENA, 'gpintenb': GPINTENB,
+    'defvala': DEFVALA, 'defvalb': DEFVALB,
+    'intcona': INTCONA, 'intconb': INTCONB,
+    'iocon': IOCON,
+    'gppua': GPPUA, 'gppub': GPPUB,
+    'intfa': INTFA, 'intfb': INTFB,
+    'intcapa': INTCAPA, 'intcapb': INTCAPB,
+    'gpioa': GPIOA, 'gpiob': GPIOB,
+    'olata': OLATA, 'olatb': OLATB,
+}
+
+
+class RegisterFile(object):
+    """The registers of many MCP23S17 chips in one contiguous bytearray,
+    NUM_REGISTERS bytes per chip in address order.
+
+    The registers are read from the chips with :meth:`fill` and can then
+    be examined without touching the bus, either as memoryviews or through
+    :meth:`chip`, which works with the usual register, nibble and bit
+    objects.
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=i)
+    ...          for i in range(4)]
+    >>> registers = pifacecommon.registerfile.RegisterFile(chips)
+    >>> registers.fill()
+    >>> registers['gpioa'].tolist()  # GPIOA of every chip
+    [255, 255, 255, 255]
+    >>> registers.chip(2).gpiob.bits[3].value
+    1
+    >>> before = registers.serialize()
+    >>> registers.fill()
+    >>> registers.diff(before)  # (chip index, address, before, now)
+    []
+    """
+    def __init__(self, chips):
+        """
+        :param chips: The chips to hold the registers of.
+        :type chips: list of :class:`pifacecommon.mcp23s17.MCP23S17`
+        """
+        self.chips = list(chips)
+        self.data = bytearray(len(self.chips) * NUM_REGISTERS)
+        self.view = memoryview(self.data)
+        self._chip_views = [None] * len(self.chips)
+
+    def __getitem__(self, name):
+        """Returns a memoryview of a register (name or address) on every
+        chip.
+        """
+        address = REGISTER_ADDRESSES.get(name, name)
+        return self.view[address::NUM_REGISTERS]
+
+    def chip(self, chip_index):
+        """Returns a chip-like view of one chip's registers.
+
+        :param chip_index: The chip's index in :attr:`chips`.
+        :type chip_index: int
+        :returns: :class:`ChipRegisters`
+        """
+        chip_view = self._chip_views[chip_index]
+        if chip_view is None:
+            chip_view = self._chip_views[chip_index] = ChipRegisters(
+                self.chips[chip_index],
+                self.view[chip_index * NUM_REGISTERS:
+                          (chip_index + 1) * NUM_REGISTERS])
+        return chip_view
+
+    def fill(self, executor=None):
+        """Reads every register of every chip: 11 A/B pair reads per chip,
+        in one ioctl per SPI device. Note that, as on the chip, reading
+        INTCAP and GPIO clears the interrupt flags (INTF is read first).
+
+        :param executor: Sends the batch (default: one SPI device at a time).
+        :type executor: :class:`pifacecommon.multibus.MultiBusExecutor`
+        """
+        chip_messages = list()
+        for chip in self.chips:
+            ctrl_byte = chip._get_spi_control_byte(READ_CMD)
+            # the address pointer moves from the A register to the B
+            # register whether IOCON.SEQOP is set or not
+            for address in range(0, NUM_REGISTERS, 2):
+                chip_messages.append(
+                    (chip, bytes(bytearray((ctrl_byte, address, 0, 0)))))
+        send = send_batched if executor is None else executor.send_batched
+        for i, reply in enumerate(send(chip_messages)):
+            self.data[i*2:i*2+2] = bytearray(reply)[2:4]
+
+    def diff(self, other):
+        """Returns the registers that differ from another register file (or
+        the output of :meth:`serialize`).
+
+        :param other: The registers to compare with.
+        :type other: :class:`RegisterFile` or bytes
+        :returns: list -- (chip index, address, other value, value) tuples
+        """
+        if isinstance(other, RegisterFile):
+            other = other.data
+        other = bytearray(other)
+        if len(other) != len(self.data):
+            raise ValueError(
+                "Register files have different sizes (%d, %d bytes)." %
+                (len(other), len(self.data)))
+        changes = list()
+        for chip_index in range(len(self.chips)):
+            start = chip_index * NUM_REGISTERS
+            end = start + NUM_REGISTERS
+            if self.data[start:end] == other[start:end]:
+                continue
+            for address in range(NUM_REGISTERS):
+                old_value = other[start + address]
+                new_value = self.data[start + address]
+                if old_value != new_value:
+                    changes.append(
+                        (chip_index, address, old_value, new_value))
+        return changes
+
+    def serialize(self):
+        """Returns a copy of the registers.
+
+        :returns: bytes
+        """
+        return bytes(self.data)
+
+    def load(self, data):
+        """Replaces the registers with the output of :meth:`serialize`."""
+        if len(data) != len(self.data):
+            raise ValueError(
+                "Expected %d bytes, got %d." % (len(self.data), len(data)))
+        self.data[:] = data
+
+
+class ChipRegisters(object):
+    """One chip's registers in a :class:`RegisterFile`. It has the read and
+    write methods of :class:`pifacecommon.mcp23s17.MCP23S17` (and its
+    register attributes, iodira to olatb) but they only change the register
+    file, never the chip.
+    """
+    metrics = None
+
+    def __init__(self, chip, view):
+        """
+        :param chip: The chip the registers were read from.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param view: The chip's registers.
+        :type view: memoryview
+        """
+        self.chip = chip
+        self.hardware_addr = chip.hardware_addr
+        self.bus = chip.bus
+        self.chip_select = chip.chip_select
+        self.view = view
+
+    def __getattr__(self, name):
+        address = REGISTER_ADDRESSES.get(name)
+        if address is None:
+            raise AttributeError(name)
+        register = MCP23S17Register(address, self)
+        setattr(self, name, register)
+        return register
+
+    def read(self, address):
+        """Returns the value of the address specified."""
+        return self.view[address]
+
+    def write(self, data, address):
+        """Writes data to the address specified."""
+        self.view[address] = data & 0xFF
+
+    def read_bit(self, bit_num, address):
+        """Returns the bit specified from the address."""
+        return 1 if self.view[address] & get_bit_mask(bit_num) else 0
+
+    def write_bit(self, value, bit_num, address):
+        """Writes the value given to the bit in the address specified."""
+        bit_mask = get_bit_mask(bit_num)
+        if value:
+            self.view[address] |= bit_mask
+        else:
+            self.view[address] &= ~bit_mask
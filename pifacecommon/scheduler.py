@@ -0,0 +1,248 @@
+import threading
+from .core import monotonic, get_bit_mask
+from .mcp23s17 import OLATA, latch_message, read_ports, send_batched
+
+
+DEFAULT_TICK = 0.001  # seconds
+WHEEL_BITS = 8
+WHEEL_SLOTS = 1 << WHEEL_BITS
+WHEEL_LEVELS = 4  # 2**32 ticks, ~49 days at 1ms
+
+
+class TimerWheel(object):
+    """A hierarchical timer wheel. Adding and cancelling a timer is O(1) and
+    each tick only looks at one slot, however many timers are pending.
+
+    Level 0 has a slot for each of the next 256 ticks, level 1 a slot for
+    each of the next 256 blocks of 256 ticks and so on. When the lower
+    levels wrap around, the timers in the next slot up are moved down.
+    Timers beyond the top level wait in an overflow list.
+    """
+    def __init__(self, levels=WHEEL_LEVELS):
+        self.levels = levels
+        self.wheels = [[list() for i in range(WHEEL_SLOTS)]
+                       for level in range(levels)]
+        self.overflow = list()
+        self.now = 0  # the next tick to expire
+        self.pending = 0
+
+    def add(self, tick, item):
+        """Expires item on tick (or on the next tick if it has passed)."""
+        self._place(max(tick, self.now), item)
+        self.pending += 1
+
+    def advance(self, tick):
+        """Expires every tick up to and including tick.
+
+        :returns: list -- the items that expired, in order
+        """
+        expired = list()
+        while self.now <= tick:
+            if self.pending == len(expired):
+                self.now = tick + 1  # the wheel is empty, skip ahead
+                break
+            if self.now & (WHEEL_SLOTS - 1) == 0:
+                self._cascade()
+            slot = self.wheels[0][self.now & (WHEEL_SLOTS - 1)]
+            if slot:
+                expired.extend(item for expiry, item in slot)
+                del slot[:]
+            self.now += 1
+        self.pending -= len(expired)
+        return expired
+
+    def next_expiry(self):
+        """Returns the next tick that has timers to expire or to move down
+        from a higher level, or None if there are no timers.
+        """
+        if self.pending == 0:
+            return None
+        if self.now & (WHEEL_SLOTS - 1) == 0:
+            return self.now
+        end = (self.now | (WHEEL_SLOTS - 1)) + 1
+        wheel = self.wheels[0]
+        for tick in range(self.now, end):
+            if wheel[tick & (WHEEL_SLOTS - 1)]:
+                return tick
+        return end
+
+    def _place(self, expiry, item):
+        delta = expiry - self.now
+        for level in range(self.levels):
+            if delta < 1 << (WHEEL_BITS * (level + 1)):
+                index = (expiry >> (WHEEL_BITS * level)) & (WHEEL_SLOTS - 1)
+                self.wheels[level][index].append((expiry, item))
+                return
+        self.overflow.append((expiry, item))
+
+    def _cascade(self):
+        # move the timers down from every level that has wrapped, top first
+        level = 1
+        while level < self.levels:
+            shift = WHEEL_BITS * level
+            if self.now & ((1 << shift) - 1):
+                break
+            level += 1
+        if level == self.levels:
+            overflow, self.overflow = self.overflow, list()
+            for expiry, item in overflow:
+                self._place(expiry, item)
+        for level in reversed(range(1, level)):
+            index = (self.now >> (WHEEL_BITS * level)) & (WHEEL_SLOTS - 1)
+            slot = self.wheels[level][index]
+            self.wheels[level][index] = list()
+            for expiry, item in slot:
+                self._place(expiry, item)
+
+
+class ScheduledOutput(object):
+    """An output change waiting in an :class:`OutputScheduler`."""
+    __slots__ = ('chip_index', 'mask', 'value', 'cancelled')
+
+    def __init__(self, chip_index, mask, value):
+        self.chip_index = chip_index
+        self.mask = mask
+        self.value = value
+        self.cancelled = False
+
+    def cancel(self):
+        """Stops the output change from happening."""
+        self.cancelled = True
+
+
+class OutputScheduler(object):
+    """Sets the outputs (OLATA bits 0-7, OLATB bits 8-15) of many MCP23S17
+    chips at given times from a single thread, instead of a
+    threading.Timer per action.
+
+    Deadlines are kept in a :class:`TimerWheel` on a monotonic clock, in
+    whole ticks from when the scheduler was created, so they do not drift.
+    Every change due on the same tick is merged into one latch write per
+    chip and those are sent in one ioctl per SPI device. The latches of
+    those chips are read just before, in one batch, so the other outputs
+    keep whatever values they have been given since.
+
+    >>> chips = [pifacecommon.mcp23s17.MCP23S17(hardware_addr=i)
+    ...          for i in range(4)]
+    >>> scheduler = pifacecommon.scheduler.OutputScheduler(chips)
+    >>> scheduler.start()
+    >>> on, off = scheduler.pulse(chips[0], 7, 0.25)  # on for 250 ms
+    >>> start_up = scheduler.stagger([(chip, 0) for chip in chips], 0.5)
+    """
+    def __init__(self, chips, tick=DEFAULT_TICK):
+        """
+        :param chips: The chips to drive.
+        :type chips: list of :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param tick: Length of a tick in seconds.
+        :type tick: float
+        """
+        self.chips = list(chips)
+        self.tick = tick
+        self.origin = monotonic()
+        self.wheel = TimerWheel()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_later(self, delay, chip, pin_num, value):
+        """Sets an output after delay seconds.
+
+        :param delay: Seconds from now.
+        :type delay: float
+        :param chip: The chip the output is on.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param pin_num: The pin number (0-15).
+        :type pin_num: int
+        :param value: The value to set (0/1).
+        :type value: int
+        :returns: :class:`ScheduledOutput`
+        """
+        mask = get_bit_mask(pin_num)
+        action = ScheduledOutput(
+            self.chips.index(chip), mask, mask if value else 0)
+        # round up so that an action never happens early
+        tick = -int(-(monotonic() + delay - self.origin) // self.tick)
+        with self._lock:
+            self.wheel.add(tick, action)
+        self._wakeup.set()
+        return action
+
+    def pulse(self, chip, pin_num, duration, value=1):
+        """Sets an output now and sets it back after duration seconds.
+
+        :returns: list -- the two :class:`ScheduledOutput`
+        """
+        return [self.set_later(0, chip, pin_num, value),
+                self.set_later(duration, chip, pin_num, not value)]
+
+    def stagger(self, chip_pins, interval, value=1, delay=0):
+        """Sets outputs one after the other, interval seconds apart.
+
+        :param chip_pins: (chip, pin num) pairs in the order to set them.
+        :type chip_pins: list
+        :returns: list -- the :class:`ScheduledOutput` of each pin
+        """
+        return [self.set_later(delay + i * interval, chip, pin_num, value)
+                for i, (chip, pin_num) in enumerate(chip_pins)]
+
+    def start(self):
+        """Starts setting outputs from a background thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background thread. Pending changes stay scheduled."""
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def run_due(self):
+        """Writes the changes that are due.
+
+        :returns: int -- the number of changes made
+        """
+        now = int((monotonic() - self.origin) // self.tick)
+        with self._lock:
+            actions = self.wheel.advance(now)
+        if not actions:
+            return 0
+
+        # chip index -> [bits to change, their new values], in order
+        changes = dict()
+        for action in actions:
+            if not action.cancelled:
+                change = changes.setdefault(action.chip_index, [0, 0])
+                change[0] |= action.mask
+                change[1] = (change[1] & ~action.mask) | action.value
+        if not changes:
+            return 0
+
+        chips = [self.chips[chip_index] for chip_index in changes]
+        chip_messages = list()
+        for chip, (mask, value), (port_a, port_b) in zip(
+                chips, changes.values(), read_ports(chips, OLATA)):
+            old_value = port_a | (port_b << 8)
+            new_value = (old_value & ~mask) | value
+            message = latch_message(chip, old_value, new_value)
+            if message is not None:
+                chip_messages.append((chip, message))
+        if chip_messages:
+            send_batched(chip_messages)
+        return len(actions)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            with self._lock:
+                next_tick = self.wheel.next_expiry()
+            if next_tick is None:
+                self._wakeup.wait()
+                continue
+            delay = self.origin + next_tick * self.tick - monotonic()
+            if delay > 0 and self._wakeup.wait(delay):
+                continue  # something was scheduled, it might be sooner
+            self.run_due()
@@ -1,36 +1,111 @@
 import posix
 import ctypes
 from fcntl import ioctl
-from .linux_spi_spidev import spi_ioc_transfer, SPI_IOC_MESSAGE
+from .core import monotonic
+from .asm_generic_ioctl import _IOC_SIZEBITS
+from .linux_spi_spidev import (
+    spi_ioc_transfer,
+    SPI_IOC_MESSAGE,
+    SPI_IOC_WR_MODE,
+    SPI_IOC_WR_BITS_PER_WORD,
+    SPI_IOC_WR_MAX_SPEED_HZ,
+    SPI_MODE_0,
+)
 
 
 SPIDEV = '/dev/spidev'
 SPI_HELP_LINK = "http://piface.github.io/pifacecommon/installation.html" \
     "#enable-the-spi-module"
 
+DEFAULT_SPEED_HZ = 100000
+
+# SPI_IOC_MESSAGE(N) only fits N transfers in the 14 bit size field of the
+# request, above that it asks spidev to send nothing
+MAX_TRANSFERS = ((1 << _IOC_SIZEBITS) - 1) // ctypes.sizeof(spi_ioc_transfer)
+# spidev refuses an ioctl of more than bufsiz bytes (a module parameter)
+SPIDEV_BUFSIZ_PATH = '/sys/module/spidev/parameters/bufsiz'
+DEFAULT_SPIDEV_BUFSIZ = 4096
+
+# speeds chosen by MCP23S17.tune_speed, keyed by (bus, chip_select)
+tuned_speed_hz = dict()
+
 
 class SPIInitError(Exception):
     pass
 
 
+def get_spidev_bufsiz():
+    """Returns the most bytes spidev sends (or receives) in one ioctl."""
+    try:
+        with open(SPIDEV_BUFSIZ_PATH) as bufsiz_file:
+            return int(bufsiz_file.read())
+    except (IOError, OSError, ValueError):
+        return DEFAULT_SPIDEV_BUFSIZ
+
+
+def ioctl_slices(messages, bufsiz=DEFAULT_SPIDEV_BUFSIZ,
+                 max_transfers=MAX_TRANSFERS):
+    """Returns (start, end) slices of messages that each fit in one
+    SPI_IOC_MESSAGE ioctl.
+
+    :param messages: The messages to send.
+    :type messages: list of bytes
+    :param bufsiz: The most bytes in one ioctl.
+    :type bufsiz: int
+    :param max_transfers: The most messages in one ioctl.
+    :type max_transfers: int
+    :returns: list -- (start, end) tuples
+    """
+    slices = list()
+    start = size = 0
+    for i, message in enumerate(messages):
+        if i - start == max_transfers or \
+                (i > start and size + len(message) > bufsiz):
+            slices.append((start, i))
+            start = i
+            size = 0
+        size += len(message)
+    if start < len(messages):
+        slices.append((start, len(messages)))
+    return slices
+
+
 class SPIDevice(object):
     """An SPI Device at /dev/spi<bus>.<chip_select>."""
-    def __init__(self, bus=0, chip_select=0, spi_callback=None, speed_hz=100000):
-        """Initialises the SPI device file descriptor.
+    def __init__(self, bus=0, chip_select=0, spi_callback=None, speed_hz=None,
+                 mode=SPI_MODE_0, bits_per_word=8):
+        """Initialises the SPI device file descriptor and configures the
+        mode, word size and max speed of the device.
 
         :param bus: The SPI device bus number
         :type bus: int
         :param chip_select: The SPI device chip_select number
         :param chip_select: int
+        :param speed_hz: The SPI clock speed. If None then the speed chosen
+            by a previous tune on this bus is used, else DEFAULT_SPEED_HZ.
+        :type speed_hz: int
+        :param mode: The SPI mode (SPI_MODE_0..SPI_MODE_3).
+        :type mode: int
+        :param bits_per_word: The SPI word size.
+        :type bits_per_word: int
         :raises: InitError
         """
         self.bus = bus
         self.chip_select = chip_select
         self.spi_callback = spi_callback
+        if speed_hz is None:
+            speed_hz = tuned_speed_hz.get((bus, chip_select),
+                                          DEFAULT_SPEED_HZ)
         self.speed_hz = speed_hz
+        self.mode = mode
+        self.bits_per_word = bits_per_word
+        self.metrics = None
+        self.capture = None
+        self.bufsiz = get_spidev_bufsiz()
         self.fd = None
         spi_device = "%s%d.%d" % (SPIDEV, self.bus, self.chip_select)
         self.open_fd(spi_device)
+        self.configure()
 
     # def __del__(self):
     #     if self.fd is not None:
@@ -49,6 +124,68 @@ class SPIDevice(object):
         posix.close(self.fd)
         self.fd = None
 
+    def configure(self, speed_hz=None, mode=None, bits_per_word=None):
+        """Writes the mode, word size and max speed to the SPI device. These
+        persist in the driver so they only need to be set once.
+
+        :param speed_hz: The SPI clock speed (default: unchanged).
+        :type speed_hz: int
+        :param mode: The SPI mode (default: unchanged).
+        :type mode: int
+        :param bits_per_word: The SPI word size (default: unchanged).
+        :type bits_per_word: int
+        :raises: InitError
+        """
+        if speed_hz is not None:
+            self.speed_hz = speed_hz
+        if mode is not None:
+            self.mode = mode
+        if bits_per_word is not None:
+            self.bits_per_word = bits_per_word
+
+        try:
+            ioctl(self.fd, SPI_IOC_WR_MODE, ctypes.c_uint8(self.mode))
+            ioctl(self.fd, SPI_IOC_WR_BITS_PER_WORD,
+                  ctypes.c_uint8(self.bits_per_word))
+            ioctl(self.fd, SPI_IOC_WR_MAX_SPEED_HZ,
+                  ctypes.c_uint32(self.speed_hz))
+        except IOError as e:
+            raise SPIInitError(
+                "Could not configure SPI device %d.%d (%s)"
+                % (self.bus, self.chip_select, e)
+            )
+
+    def enable_metrics(self):
+        """Starts counting the traffic on this device.
+
+        :returns: :class:`pifacecommon.metrics.SPIMetrics`
+        """
+        from .metrics import SPIMetrics
+        if self.metrics is None:
+            self.metrics = SPIMetrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        """Stops counting the traffic on this device."""
+        self.metrics = None
+
+    def enable_capture(self, capture):
+        """Starts recording every transfer on this device. A capture can be
+        shared by several devices.
+
+        :param capture: Where to record the transfers.
+        :type capture: :class:`pifacecommon.capture.SPICapture`
+        :returns: :class:`pifacecommon.capture.SPICapture`
+        """
+        self.capture = capture
+        return capture
+
+    def disable_capture(self):
+        """Stops recording the transfers on this device (the capture is
+        left open).
+        """
+        self.capture = None
+
     def spisend(self, bytes_to_send):
         """Sends bytes via the SPI bus.
 
@@ -57,21 +194,136 @@ class SPIDevice(object):
         :returns: bytes -- returned bytes from SPI device
         :raises: InitError
         """
+        return self.spisend_many((bytes_to_send,))[0]
+
+    def spisend_many(self, messages, delays_usecs=None):
+        """Sends several messages via the SPI bus. The chip select is
+        released between each message. The messages are sent in as few
+        ioctls as spidev allows (see :func:`ioctl_slices`), usually one.
+
+        :param messages: The messages to send on the SPI device.
+        :type messages: list of bytes
+        :param delays_usecs: Microseconds the driver waits after each message
+            (max 65535).
+        :type delays_usecs: list of int
+        :returns: list -- returned bytes from SPI device for each message
+        """
+        messages = list(messages)
+        if delays_usecs is not None:
+            delays_usecs = list(delays_usecs)
+        replies = list()
+        for start, end in ioctl_slices(messages, self.bufsiz):
+            replies.extend(self._spisend_ioctl(
+                messages[start:end],
+                None if delays_usecs is None else delays_usecs[start:end]))
+        return replies
+
+    def _spisend_ioctl(self, messages, delays_usecs):
+        count = len(messages)
         # make some buffer space to store reading/writing
-        wbuffer = ctypes.create_string_buffer(bytes_to_send,
-                                              len(bytes_to_send))
-        rbuffer = ctypes.create_string_buffer(len(bytes_to_send))
-
-        # create the spi transfer struct
-        transfer = spi_ioc_transfer(
-            tx_buf=ctypes.addressof(wbuffer),
-            rx_buf=ctypes.addressof(rbuffer),
-            len=ctypes.sizeof(wbuffer),
-            speed_hz=ctypes.c_uint32(self.speed_hz)
-        )
+        transfers = (spi_ioc_transfer * count)()
+        buffers = list()
+        for transfer, message in zip(transfers, messages):
+            wbuffer = ctypes.create_string_buffer(message, len(message))
+            rbuffer = ctypes.create_string_buffer(len(message))
+            buffers.append((wbuffer, rbuffer))
+            transfer.tx_buf = ctypes.addressof(wbuffer)
+            transfer.rx_buf = ctypes.addressof(rbuffer)
+            transfer.len = ctypes.sizeof(wbuffer)
+            transfer.speed_hz = self.speed_hz
+            transfer.cs_change = 1
+        transfers[count-1].cs_change = 0
+        if delays_usecs is not None:
+            for transfer, delay in zip(transfers, delays_usecs):
+                transfer.delay_usecs = delay
 
         if self.spi_callback is not None:
-            self.spi_callback(bytes_to_send)
+            for message in messages:
+                self.spi_callback(message)
         # send the spi command
-        ioctl(self.fd, SPI_IOC_MESSAGE(1), transfer)
-        return ctypes.string_at(rbuffer, ctypes.sizeof(rbuffer))
+        if self.metrics is None and self.capture is None:
+            ioctl(self.fd, SPI_IOC_MESSAGE(count), transfers)
+            return [ctypes.string_at(rbuffer, ctypes.sizeof(rbuffer))
+                    for wbuffer, rbuffer in buffers]
+
+        start_time = monotonic()
+        ioctl(self.fd, SPI_IOC_MESSAGE(count), transfers)
+        if self.metrics is not None:
+            self.metrics.record_ioctl(messages, start_time)
+        replies = [ctypes.string_at(rbuffer, ctypes.sizeof(rbuffer))
+                   for wbuffer, rbuffer in buffers]
+        if self.capture is not None:
+            self.capture.record(
+                self, [len(message) for message in messages],
+                b''.join(messages), b''.join(replies), self.speed_hz,
+                start_time)
+        return replies
+
+
+class SPITransferPlan(object):
+    """A fixed list of messages compiled once into a pinned spi_ioc_transfer
+    array. Running the plan sends every message in a single ioctl without
+    building any new buffers. The data to send can be changed in place
+    through :attr:`tx` and replies are read from :attr:`rx`, both of which
+    are memoryviews of the messages laid end to end.
+    """
+    def __init__(self, device, messages):
+        """
+        :param device: The device to send the messages on.
+        :type device: :class:`SPIDevice`
+        :param messages: The messages (their contents can change later).
+        :type messages: list of bytes
+        :raises: ValueError if the messages don't fit in one ioctl
+        """
+        self.device = device
+        count = len(messages)
+        data = b''.join(messages)
+        if not 0 < count <= MAX_TRANSFERS or len(data) > device.bufsiz:
+            raise ValueError(
+                "A plan must fit in one ioctl: 1 to %d messages of at most "
+                "%d bytes in total (got %d messages, %d bytes)." %
+                (MAX_TRANSFERS, device.bufsiz, count, len(data)))
+        self.wbuffer = ctypes.create_string_buffer(data, len(data))
+        self.rbuffer = ctypes.create_string_buffer(len(data))
+        self.transfers = (spi_ioc_transfer * count)()
+        self.request = SPI_IOC_MESSAGE(count)
+        offset = 0
+        for transfer, message in zip(self.transfers, messages):
+            transfer.tx_buf = ctypes.addressof(self.wbuffer) + offset
+            transfer.rx_buf = ctypes.addressof(self.rbuffer) + offset
+            transfer.len = len(message)
+            transfer.speed_hz = device.speed_hz
+            transfer.cs_change = 1
+            offset += len(message)
+        self.transfers[count-1].cs_change = 0
+        self.messages = messages
+        self.message_lengths = [len(message) for message in messages]
+        self.tx = memoryview(self.wbuffer).cast('B')
+        self.rx = memoryview(self.rbuffer).cast('B')
+
+    def run(self):
+        """Sends the messages.
+
+        :returns: memoryview -- the replies laid end to end (reused by the
+            next run)
+        """
+        if self.device.spi_callback is not None:
+            offset = 0
+            for length in self.message_lengths:
+                self.device.spi_callback(
+                    self.tx[offset:offset+length].tobytes())
+                offset += length
+        device = self.device
+        if device.metrics is None and device.capture is None:
+            ioctl(device.fd, self.request, self.transfers)
+            return self.rx
+
+        start_time = monotonic()
+        ioctl(device.fd, self.request, self.transfers)
+        if device.metrics is not None:
+            device.metrics.record_ioctl(self.messages, start_time)
+        if device.capture is not None:
+            device.capture.record(
+                device, self.message_lengths, self.tx.tobytes(),
+                self.rx.tobytes(), self.transfers[0].speed_hz, start_time)
+        return self.rx
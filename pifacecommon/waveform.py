@@ -0,0 +1,130 @@
+from .core import monotonic
+from .mcp23s17 import OLATA, WRITE_CMD
+
+
+# the widest gap spi_ioc_transfer.delay_usecs can hold
+MAX_DELAY_USECS = 0xFFFF
+# transfers per ioctl, well inside SPI_MSGSIZE and the spidev buffer size
+DEFAULT_CHUNK_SIZE = 256
+BITS_PER_WRITE = 24  # control byte, address, data
+
+
+class WaveformTiming(object):
+    """How long a waveform was asked to take and how long it actually took
+    (in microseconds).
+    """
+    def __init__(self, requested_us, transfer_us, achieved_us, chunks):
+        self.requested_us = requested_us
+        self.transfer_us = transfer_us
+        self.achieved_us = achieved_us
+        self.chunks = chunks
+
+    def __str__(self):
+        s = "requested: {requested}us\n" \
+            "transfer:  {transfer}us\n" \
+            "achieved:  {achieved}us\n" \
+            "error:     {error}us\n" \
+            "chunks:    {chunks}"
+        return s.format(requested=self.requested_us,
+                        transfer=self.transfer_us,
+                        achieved=self.achieved_us,
+                        error=self.error_us,
+                        chunks=self.chunks)
+
+    @property
+    def error_us(self):
+        """Time taken over the requested hold times and the time spent
+        clocking the writes themselves.
+        """
+        return self.achieved_us - self.requested_us - self.transfer_us
+
+
+class Waveform(object):
+    """A sequence of (port value, hold time) steps written to an output
+    register of an MCP23S17. The gaps between writes are timed by the kernel
+    SPI driver (spi_ioc_transfer.delay_usecs) instead of by Python.
+
+    >>> chip = pifacecommon.mcp23s17.MCP23S17()
+    >>> wave = pifacecommon.waveform.Waveform(chip)
+    >>> wave.append(0xFF, 500)  # all on for 500us
+    >>> wave.append(0x00, 1500)  # all off for 1500us
+    >>> timing = wave.play(repeat=100)
+    """
+    def __init__(self, chip, address=OLATA, steps=(),
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        :param chip: The chip to write to.
+        :type chip: :class:`pifacecommon.mcp23s17.MCP23S17`
+        :param address: The register to write each value to.
+        :type address: int
+        :param steps: (value, hold time in microseconds) pairs.
+        :type steps: list
+        :param chunk_size: Max number of writes sent in one ioctl.
+        :type chunk_size: int
+        """
+        self.chip = chip
+        self.address = address
+        self.chunk_size = chunk_size
+        self.steps = list()
+        self._chunks = None
+        for value, hold_us in steps:
+            self.append(value, hold_us)
+
+    def append(self, value, hold_us):
+        """Adds a step to the end of the waveform.
+
+        :param value: The register value.
+        :type value: int
+        :param hold_us: Microseconds to hold the value for.
+        :type hold_us: int
+        """
+        self.steps.append((value & 0xFF, int(hold_us)))
+        self._chunks = None
+
+    def compile(self):
+        """Returns the waveform as a list of (messages, delays) chunks, each
+        of which is sent in a single ioctl. Holds longer than
+        MAX_DELAY_USECS are split by rewriting the same value.
+        """
+        if self._chunks is not None:
+            return self._chunks
+
+        ctrl_byte = self.chip._get_spi_control_byte(WRITE_CMD)
+        messages = list()
+        delays = list()
+        for value, hold_us in self.steps:
+            message = bytes(bytearray((ctrl_byte, self.address, value)))
+            while True:
+                delay = min(hold_us, MAX_DELAY_USECS)
+                messages.append(message)
+                delays.append(delay)
+                hold_us -= delay
+                if hold_us <= 0:
+                    break
+
+        self._chunks = [
+            (messages[i:i+self.chunk_size], delays[i:i+self.chunk_size])
+            for i in range(0, len(messages), self.chunk_size)]
+        return self._chunks
+
+    def play(self, repeat=1):
+        """Writes the waveform to the chip and measures how long it took.
+
+        :param repeat: Number of times to play the waveform.
+        :type repeat: int
+        :returns: :class:`WaveformTiming`
+        """
+        chunks = self.compile()
+        writes = sum(len(messages) for messages, delays in chunks)
+
+        start = monotonic()
+        for i in range(repeat):
+            for messages, delays in chunks:
+                self.chip.spisend_many(messages, delays)
+        achieved_us = (monotonic() - start) * 1000000
+
+        requested_us = repeat * sum(hold_us for value, hold_us in self.steps)
+        transfer_us = (repeat * writes * BITS_PER_WRITE * 1000000.0 /
+                       self.chip.speed_hz)
+        return WaveformTiming(
+            requested_us, transfer_us, achieved_us, repeat * len(chunks))
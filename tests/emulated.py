@@ -0,0 +1,193 @@
+"""Emulated SPI devices and interrupt line for the tests."""
+import os
+import time
+import ctypes
+import select
+import threading
+from unittest import mock
+import pifacecommon.spi
+import pifacecommon.interrupts
+from pifacecommon.mcp23s17 import MCP23S17, HAEN_ON
+from pifacecommon.emulator import MCP23S17Model
+from pifacecommon.linux_spi_spidev import spi_ioc_transfer
+
+
+def make_chips(devices=((0, 0),), hardware_addrs=range(4)):
+    """Returns the chips on each SPI device, with IOCON.HAEN set so that
+    every chip answers to its own address.
+
+    :param devices: (bus, chip select) of each SPI device.
+    :type devices: list
+    :param hardware_addrs: The chips on every SPI device.
+    :type hardware_addrs: list
+    """
+    chips = [MCP23S17(hardware_addr=hardware_addr, bus=bus,
+                      chip_select=chip_select)
+             for bus, chip_select in devices
+             for hardware_addr in hardware_addrs]
+    for chip in chips:
+        chip.iocon.value = HAEN_ON
+    return chips
+
+
+class EmulatedBoards(object):
+    """Replaces every spidev device with a
+    :class:`pifacecommon.emulator.MCP23S17Model` of its own and the GPIO25
+    interrupt line with one that is asserted while any chip has an interrupt
+    flagged, for as long as the context is active.
+
+    >>> with EmulatedBoards(ioctl_time=0.001) as boards:
+    ...     chip = pifacecommon.mcp23s17.MCP23S17()
+    ...     boards.set_inputs(0, 0, 0x01)
+    ...     chip.gpioa.value
+    1
+    """
+    def __init__(self, hardware_addrs=range(4), ioctl_time=0):
+        """
+        :param hardware_addrs: The chips on every SPI device.
+        :type hardware_addrs: list
+        :param ioctl_time: Seconds each SPI_IOC_MESSAGE takes, spent with
+            the GIL released like a real ioctl.
+        :type ioctl_time: float
+        """
+        self.hardware_addrs = hardware_addrs
+        self.ioctl_time = ioctl_time
+        self.models = dict()  # device path -> MCP23S17Model
+        self.ioctls = 0
+        self.unplugged = False
+        self._devices = dict()  # fd -> device path
+        self._lock = threading.RLock()
+        self._line_changed = threading.Condition(self._lock)
+        posix = mock.Mock(O_RDWR=os.O_RDWR)
+        posix.open.side_effect = self._open
+        posix.close.side_effect = self._close
+        self._patches = [
+            mock.patch.object(pifacecommon.spi, 'posix', posix),
+            mock.patch.object(pifacecommon.spi, 'ioctl', self._ioctl),
+            mock.patch.object(select, 'epoll', self._epoll, create=True),
+            mock.patch.object(pifacecommon.interrupts, 'open',
+                              self._open_gpio, create=True),
+        ]
+
+    def __enter__(self):
+        for patch in self._patches:
+            patch.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patch in reversed(self._patches):
+            patch.stop()
+
+    def model(self, bus=0, chip_select=0):
+        """Returns the model behind an SPI device."""
+        path = "%s%d.%d" % (pifacecommon.spi.SPIDEV, bus, chip_select)
+        with self._lock:
+            if path not in self.models:
+                self.models[path] = MCP23S17Model(self.hardware_addrs)
+            return self.models[path]
+
+    def set_inputs(self, hardware_addr, port, value, bus=0, chip_select=0):
+        """Drives the input pins of a port (0 for A, 1 for B)."""
+        model = self.model(bus, chip_select)
+        with self._lock:
+            model.set_inputs(hardware_addr, port, value)
+            self._line_changed.notify_all()
+
+    def unplug(self):
+        """Stops every detector waiting on the interrupt line, as if with a
+        KeyboardInterrupt.
+        """
+        with self._lock:
+            self.unplugged = True
+            self._line_changed.notify_all()
+
+    def interrupt_asserted(self):
+        with self._lock:
+            return any(model.interrupt_asserted()
+                       for model in self.models.values())
+
+    def _open(self, path, flags):
+        with self._lock:
+            fd = len(self._devices) + 1000
+            self._devices[fd] = path
+        return fd
+
+    def _close(self, fd):
+        pass  # the fds of closed devices are not reused
+
+    def _ioctl(self, fd, request, arg, *args):
+        if not isinstance(arg, ctypes.Array) or \
+                arg._type_ is not spi_ioc_transfer:
+            return 0  # configuration
+        if self.ioctl_time:
+            time.sleep(self.ioctl_time)
+        path = self._devices[fd]
+        with self._lock:
+            model = self.models.get(path)
+            if model is None:
+                model = self.models[path] = MCP23S17Model(
+                    self.hardware_addrs)
+            for transfer in arg:
+                rx = model.transfer(
+                    ctypes.string_at(transfer.tx_buf, transfer.len))
+                if transfer.rx_buf:
+                    ctypes.memmove(transfer.rx_buf, rx, transfer.len)
+            self.ioctls += 1
+            self._line_changed.notify_all()
+        return 0
+
+    def _open_gpio(self, name, *args):
+        if name != pifacecommon.interrupts.GPIO_INTERRUPT_DEVICE_VALUE:
+            return open(name, *args)
+        return _GPIOValueFile(self)
+
+    def _epoll(self):
+        return _EdgePoll(self)
+
+
+class _GPIOValueFile(object):
+    """GPIO25's value file: the active low interrupt line."""
+    def __init__(self, boards):
+        self.boards = boards
+
+    def seek(self, offset):
+        pass
+
+    def read(self):
+        return '0\n' if self.boards.interrupt_asserted() else '1\n'
+
+    def close(self):
+        pass
+
+
+class _EdgePoll(object):
+    """An epoll that reports the falling edges of the interrupt line."""
+    def __init__(self, boards):
+        self.boards = boards
+        self.asserted = boards.interrupt_asserted()
+
+    def register(self, fd, eventmask=None):
+        pass
+
+    def poll(self, timeout=None):
+        if timeout is not None and timeout >= 0:
+            deadline = time.time() + timeout
+        else:
+            deadline = None
+        with self.boards._lock:
+            while True:
+                if self.boards.unplugged:
+                    raise KeyboardInterrupt
+                asserted = self.boards.interrupt_asserted()
+                if asserted and not self.asserted:
+                    self.asserted = True
+                    return [(0, select.EPOLLIN)]
+                self.asserted = asserted
+                remaining = None if deadline is None else \
+                    deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self.boards._line_changed.wait(remaining)
+
+    def close(self):
+        pass
@@ -0,0 +1,58 @@
+import asyncio
+import unittest
+from pifacecommon.mcp23s17 import MCP23S17, GPIOA, GPIOB, OLATA, OLATB
+from pifacecommon.busio import BusIOThread, READ, WRITE, UPDATE
+from .emulated import EmulatedBoards
+
+
+IOCTL_TIME = 0.05  # long enough to queue requests behind an ioctl
+
+
+class CancelTest(unittest.TestCase):
+    def setUp(self):
+        self.boards = EmulatedBoards(ioctl_time=IOCTL_TIME)
+        self.boards.__enter__()
+        self.chip = MCP23S17()
+        self.io_thread = BusIOThread(self.chip)
+        self.boards.set_inputs(0, 0, 0x12)
+        self.boards.set_inputs(0, 1, 0x34)
+
+    def tearDown(self):
+        self.boards.__exit__(None, None, None)
+
+    def test_cancelled_while_queued(self):
+        busy = self.io_thread.submit(READ, self.chip, GPIOA)
+        read = self.io_thread.submit(READ, self.chip, GPIOB)
+        write = self.io_thread.submit(WRITE, self.chip, OLATA, 0x0F)
+        update = self.io_thread.submit(
+            UPDATE, self.chip, OLATB, lambda value: value | 0x80)
+        self.assertTrue(write.cancel())
+        self.assertEqual(busy.result(1), 0x12)
+        self.assertEqual(read.result(1), 0x34)
+        self.assertEqual(update.result(1), 0x80)
+        self.assertEqual(self.chip.olata.value, 0)  # never sent
+        self.assertEqual(self.chip.olatb.value, 0x80)
+
+    def test_timeout_in_shared_batch(self):
+        async def run():
+            def submit(*args):
+                return asyncio.wrap_future(self.io_thread.submit(*args))
+            busy = submit(READ, self.chip, GPIOA)
+            await asyncio.sleep(IOCTL_TIME / 5)  # the ioctl is under way
+            read = submit(READ, self.chip, GPIOB)
+            timed_out = submit(READ, self.chip, GPIOA)
+            write = submit(WRITE, self.chip, OLATA, 0x0F)
+            update = submit(UPDATE, self.chip, OLATB,
+                            lambda value: value | 0x80)
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(timed_out, IOCTL_TIME * 1.5)
+            return await asyncio.gather(busy, read, write, update)
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [0x12, 0x34, None, 0x80])
+        self.assertEqual(self.chip.olata.value, 0x0F)
+        self.assertEqual(self.chip.olatb.value, 0x80)
+
+
+if __name__ == '__main__':
+    unittest.main()
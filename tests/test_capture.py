@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+from pifacecommon.capture import SPICapture, replay
+
+
+Device = namedtuple('Device', ['bus', 'chip_select'])
+READ_OLATA = b'\x41\x14\x00'
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'bus.cap')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def capture(self, batch_numbers):
+        capture = SPICapture(self.path)
+        # as if taken by racing threads
+        capture._batch_numbers = iter(batch_numbers)
+        for i in range(len(batch_numbers)):
+            capture.record(Device(0, 0), [3], READ_OLATA, b'\x00' * 3,
+                           10000000, i * 0.001)
+        capture.close()
+        return replay(self.path)
+
+    def test_out_of_order_batches(self):
+        report = self.capture([1, 0, 2, 4])
+        self.assertEqual(report['batches'], 4)
+        self.assertEqual(report['dropped_batches'], 1)
+        self.assertEqual(report['mismatches'], [])
+
+    def test_first_batch_not_lowest(self):
+        report = self.capture([7, 5, 6, 8])
+        self.assertEqual(report['dropped_batches'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import time
+import unittest
+import multiprocessing
+from pifacecommon.mcp23s17 import MCP23S17, GPIOA
+from pifacecommon.interrupts import (
+    EventQueue, InterruptEvent, STAT_RING_OVERFLOWS)
+from pifacecommon.eventring import RingEventQueue
+from .emulated import EmulatedBoards
+
+
+EVENTS = 2000
+LATENCY_EVENTS = 200
+LATENCY_INTERVAL = 0.001  # seconds between events
+
+
+def produce(event_queue, chips, count, interval):
+    """Puts events from every chip, as the detector does. On a
+    multiprocessing.Queue each one is pickled along with its chip.
+    """
+    for i in range(count):
+        event_queue.put(InterruptEvent(
+            1 << (i % 8), i & 0xFF, chips[i % len(chips)], time.time()))
+        if interval:
+            time.sleep(interval)
+
+
+def consume(event_queue, chips, count, interval=0):
+    """Runs a producer process and takes its events.
+
+    :returns: tuple -- (events per second, latency of each event)
+    """
+    producer = multiprocessing.get_context('fork').Process(
+        target=produce, args=(event_queue, chips, count, interval))
+    start_time = time.time()
+    producer.start()
+    latencies = list()
+    for i in range(count):
+        event = event_queue.get(5)
+        latencies.append(time.time() - event.timestamp)
+        assert event.interrupt_flag == 1 << (i % 8)
+        assert event.interrupt_capture == i & 0xFF
+        assert event.chip.hardware_addr == chips[i % len(chips)].hardware_addr
+    rate = count / (time.time() - start_time)
+    producer.join()
+    return rate, sorted(latencies)
+
+
+class RingEventQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.boards = EmulatedBoards()
+        self.boards.__enter__()
+        self.chips = [MCP23S17(hardware_addr=hardware_addr)
+                      for hardware_addr in range(4)]
+
+    def tearDown(self):
+        self.boards.__exit__(None, None, None)
+
+    def queues(self):
+        return (('multiprocessing.Queue', EventQueue(list())),
+                ('RingEventQueue', RingEventQueue(
+                    list(), self.chips, GPIOA, capacity=EVENTS)))
+
+    def test_throughput(self):
+        rates = dict()
+        for name, event_queue in self.queues():
+            try:
+                rates[name] = consume(event_queue, self.chips, EVENTS)[0]
+            finally:
+                event_queue.close()
+            print("%s: %.0f events/s" % (name, rates[name]))
+        self.assertGreater(rates['RingEventQueue'],
+                           rates['multiprocessing.Queue'])
+
+    def test_latency(self):
+        medians = dict()
+        for name, event_queue in self.queues():
+            try:
+                latencies = consume(event_queue, self.chips, LATENCY_EVENTS,
+                                    LATENCY_INTERVAL)[1]
+            finally:
+                event_queue.close()
+            self.assertEqual(len(latencies), LATENCY_EVENTS)
+            medians[name] = latencies[len(latencies) // 2]
+            print("%s: median %.0f us, 99th percentile %.0f us" % (
+                name, medians[name] * 1e6,
+                latencies[len(latencies) * 99 // 100] * 1e6))
+        self.assertLessEqual(medians['RingEventQueue'],
+                             medians['multiprocessing.Queue'])
+
+    def test_overflow_is_counted(self):
+        event_queue = RingEventQueue(list(), self.chips, GPIOA, capacity=4)
+        try:
+            produce(event_queue, self.chips, 6, 0)
+            self.assertEqual(len(event_queue.drain()), 4)
+            self.assertEqual(event_queue.stats[STAT_RING_OVERFLOWS], 2)
+        finally:
+            event_queue.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
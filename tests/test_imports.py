@@ -0,0 +1,49 @@
+import sys
+import subprocess
+import unittest
+
+
+# modules that only a PortEventListener needs
+LISTENER_MODULES = (
+    'pifacecommon.interrupts', 'multiprocessing', 'threading', 'select')
+IMPORT_TIME_BUDGET = 0.2  # seconds, generous for a Raspberry Pi Zero
+
+
+def import_times(module):
+    """Imports module in a new interpreter with -X importtime.
+
+    :returns: dict -- module name -> cumulative import time in seconds
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    times = dict()
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative_us) / 1e6
+    return times
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_mcp23s17_skips_listener_modules(self):
+        times = import_times('pifacecommon.mcp23s17')
+        for module in LISTENER_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_mcp23s17_import_time(self):
+        times = import_times('pifacecommon.mcp23s17')
+        self.assertLess(times['pifacecommon.mcp23s17'], IMPORT_TIME_BUDGET)
+
+    def test_interrupts_attribute(self):
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import pifacecommon.mcp23s17, pifacecommon; '
+             'print(pifacecommon.interrupts.PortEventListener.__name__)'],
+            universal_newlines=True)
+        self.assertEqual(output.strip(), 'PortEventListener')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import time
+import threading
+import unittest
+from pifacecommon.mcp23s17 import MCP23S17, GPIOA
+from pifacecommon.interrupts import (
+    EventQueue,
+    PinFunctionMap,
+    PortEventListener,
+    IODIR_ON,
+    STAT_INTERRUPTS,
+    STAT_SOFTWARE_FILTERED,
+    watch_port_events,
+)
+from .emulated import EmulatedBoards
+
+
+class HeldPinTest(unittest.TestCase):
+    def test_held_pin_is_not_polled(self):
+        with EmulatedBoards() as boards:
+            chip = MCP23S17()
+            boards.set_inputs(0, 0, 0x01)  # idle high
+            listener = PortEventListener(GPIOA, chip, manage_interrupts=True)
+            listener.register(0, IODIR_ON, None, settle_time=0)
+            gpinten, intcon, defval = listener.interrupt_config()
+            self.assertEqual((gpinten, intcon, defval), (0x01, 0, 0))
+            chip.gpintena.value = gpinten
+
+            pin_function_maps = [PinFunctionMap(0, IODIR_ON, None, 0)]
+            event_queue = EventQueue(pin_function_maps)
+            detector = threading.Thread(
+                target=watch_port_events,
+                args=(GPIOA, chip, pin_function_maps, event_queue, True))
+            detector.start()
+            try:
+                ioctls = boards.ioctls
+                boards.set_inputs(0, 0, 0x00)  # pressed
+                time.sleep(0.2)  # held
+                boards.set_inputs(0, 0, 0x01)  # released
+                time.sleep(0.05)
+                ioctls = boards.ioctls - ioctls
+            finally:
+                boards.unplug()
+                detector.join()
+            event = event_queue.get(1)
+        self.assertEqual(event.direction, IODIR_ON)
+        self.assertEqual(event_queue.stats[STAT_INTERRUPTS], 2)
+        self.assertEqual(event_queue.stats[STAT_SOFTWARE_FILTERED], 1)
+        # INTF and INTCAP for the press and the release, nothing while held
+        self.assertEqual(ioctls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+import unittest
+from pifacecommon.mcp23s17 import read_ports
+from pifacecommon.multibus import MultiBusExecutor
+from .emulated import EmulatedBoards, make_chips
+
+
+DEVICES = ((0, 0), (0, 1), (1, 0), (1, 1))  # (bus, chip select)
+IOCTL_TIME = 0.005  # seconds
+ROUNDS = 20
+
+
+def throughput(chips, executor=None):
+    """Returns the chips read per second."""
+    start_time = time.time()
+    for i in range(ROUNDS):
+        read_ports(chips, executor=executor)
+    return ROUNDS * len(chips) / (time.time() - start_time)
+
+
+class MultiBusExecutorTest(unittest.TestCase):
+    def test_snapshot(self):
+        with EmulatedBoards() as boards:
+            for i, (bus, chip_select) in enumerate(DEVICES):
+                for hardware_addr in range(4):
+                    boards.set_inputs(hardware_addr, 0,
+                                      i * 16 + hardware_addr,
+                                      bus, chip_select)
+            chips = make_chips(DEVICES)
+            ioctls = boards.ioctls
+            executor = MultiBusExecutor()
+            try:
+                snapshot = executor.read_ports(chips)
+            finally:
+                executor.shutdown()
+        self.assertEqual(snapshot, [(i * 16 + hardware_addr, 0)
+                                    for i in range(len(DEVICES))
+                                    for hardware_addr in range(4)])
+        self.assertEqual(len(boards.models), len(DEVICES))
+        self.assertEqual(boards.ioctls - ioctls, len(DEVICES))
+
+    def test_throughput_scales_with_buses(self):
+        with EmulatedBoards(ioctl_time=IOCTL_TIME):
+            executor = MultiBusExecutor()
+            try:
+                results = list()
+                for n in range(1, len(DEVICES) + 1):
+                    chips = make_chips(DEVICES[:n])
+                    results.append((n, throughput(chips),
+                                    throughput(chips, executor)))
+            finally:
+                executor.shutdown()
+        for n, serial, parallel in results:
+            print("%d device(s): %6.0f chips/s one at a time, "
+                  "%6.0f chips/s in parallel" % (n, serial, parallel))
+        # one ioctl time per round however many devices
+        one_device = results[0][2]
+        all_devices = results[-1][2]
+        self.assertGreater(all_devices, 2.5 * one_device)
+        self.assertGreater(all_devices, 2 * results[-1][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
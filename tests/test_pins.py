@@ -0,0 +1,55 @@
+import unittest
+from pifacecommon.mcp23s17 import OLATA, read_pins, write_pins, write_ports
+from .emulated import EmulatedBoards, make_chips
+
+
+class WritePinsTest(unittest.TestCase):
+    def setUp(self):
+        self.boards = EmulatedBoards()
+        self.boards.__enter__()
+        self.chips = make_chips()
+
+    def tearDown(self):
+        self.boards.__exit__(None, None, None)
+
+    def sent(self, function, *args):
+        """Returns the messages function sends."""
+        model = self.boards.model()
+        messages = list()
+        transfer = model.transfer
+
+        def record(tx):
+            messages.append(bytes(tx))
+            return transfer(tx)
+        model.transfer = record
+        try:
+            function(*args)
+        finally:
+            del model.transfer
+        return messages
+
+    def test_full_write(self):
+        pins = [[1] + [0] * 15] * 4
+        self.assertEqual(len(self.sent(write_pins, self.chips, pins)), 4)
+        self.assertEqual([list(map(int, chip_pins)) for chip_pins in
+                          read_pins(self.chips, OLATA)], pins)
+
+    def test_only_changes_are_written(self):
+        previous = [[0] * 16] * 4
+        write_pins(self.chips, previous)
+        pins = [[0] * 16, [1] + [0] * 15, [0] * 15 + [1], [1] * 16]
+        messages = self.sent(write_pins, self.chips, pins, OLATA, previous)
+        # nothing to chip 0, OLATA to chip 1, OLATB to chip 2, both to 3
+        self.assertEqual(messages, [b'\x42\x14\x01', b'\x44\x15\x80',
+                                    b'\x46\x14\xff\xff'])
+        self.assertEqual([list(map(int, chip_pins)) for chip_pins in
+                          read_pins(self.chips, OLATA)], pins)
+
+    def test_nothing_changed(self):
+        ports = [(1, 2)] * 4
+        self.assertEqual(
+            self.sent(write_ports, self.chips, ports, OLATA, ports), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+import unittest
+import warnings
+import multiprocessing
+from pifacecommon.mcp23s17 import MCP23S17, GPIOA
+from pifacecommon.interrupts import (
+    PinFunctionMap,
+    handle_events,
+    watch_port_events,
+    _event_matches_pin_function_map,
+)
+from pifacecommon.realtime import RealtimeOptions, RealtimeWarning, run_with
+from pifacecommon.eventring import RingEventQueue
+from .emulated import EmulatedBoards
+
+
+EDGES = 100
+EDGE_INTERVAL = 0.005  # seconds between edges
+LOAD_PROCESSES = 2 * (os.cpu_count() or 1)
+TERMINATE_SIGNAL = 'stop'
+
+
+def spin():
+    while True:
+        pass
+
+
+def start_thread(options, function, *args):
+    if options is None:
+        thread = threading.Thread(target=function, args=args)
+    else:
+        thread = threading.Thread(target=run_with,
+                                  args=(options, function) + args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def edge_latencies(realtime=None):
+    """Drives edges on GPIOA pin 0 of an emulated chip and measures how
+    long each takes to reach its callback. The detector runs in a thread
+    here so that it sees the emulated chip, and passes events through a
+    RingEventQueue (a multiprocessing.Queue's feeder thread would run at
+    normal priority).
+
+    :returns: list -- the sorted latencies in seconds
+    """
+    with EmulatedBoards() as boards:
+        chip = MCP23S17()
+        chip.gpintena.value = 0x01
+        received = threading.Event()
+        callback_times = list()
+
+        def callback(event):
+            callback_times.append(time.time())
+            received.set()
+
+        pin_function_maps = [
+            PinFunctionMap(0, None, callback, 0, debounce=False)]
+        event_queue = RingEventQueue(pin_function_maps, (chip,), GPIOA)
+        detector = start_thread(realtime, watch_port_events, GPIOA, chip,
+                                pin_function_maps, event_queue, True)
+        dispatcher = start_thread(realtime, handle_events, pin_function_maps,
+                                  event_queue, _event_matches_pin_function_map,
+                                  TERMINATE_SIGNAL)
+        latencies = list()
+        try:
+            for i in range(EDGES):
+                received.clear()
+                edge_time = time.time()
+                boards.set_inputs(0, 0, (i + 1) % 2)
+                if received.wait(1):
+                    latencies.append(callback_times[-1] - edge_time)
+                time.sleep(EDGE_INTERVAL)
+        finally:
+            event_queue.put(TERMINATE_SIGNAL)
+            dispatcher.join()
+            boards.unplug()
+            detector.join()
+            event_queue.close()
+    return sorted(latencies)
+
+
+def realtime_available():
+    def apply():
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RealtimeWarning)
+            try:
+                RealtimeOptions().apply()
+            except RealtimeWarning:
+                applied.append(False)
+            else:
+                applied.append(True)
+    applied = list()
+    thread = threading.Thread(target=apply)
+    thread.start()
+    thread.join()
+    return applied[0]
+
+
+def report(name, latencies):
+    print("%s: median %.0f us, 99th percentile %.0f us, max %.0f us" % (
+        name, latencies[len(latencies) // 2] * 1e6,
+        latencies[len(latencies) * 99 // 100] * 1e6, latencies[-1] * 1e6))
+
+
+class RealtimeLatencyTest(unittest.TestCase):
+    def test_edges_reach_callbacks(self):
+        latencies = edge_latencies()
+        report("idle", latencies)
+        self.assertEqual(len(latencies), EDGES)
+
+    def test_realtime_under_load(self):
+        if not realtime_available():
+            self.skipTest("no permission for SCHED_FIFO")
+        context = multiprocessing.get_context('fork')
+        load = [context.Process(target=spin) for i in range(LOAD_PROCESSES)]
+        for process in load:
+            process.daemon = True
+            process.start()
+        try:
+            normal = edge_latencies()
+            realtime = edge_latencies(RealtimeOptions())
+        finally:
+            for process in load:
+                process.terminate()
+                process.join()
+        report("loaded", normal)
+        report("loaded, SCHED_FIFO", realtime)
+        self.assertEqual(len(realtime), EDGES)
+        p99 = EDGES * 99 // 100
+        self.assertLess(realtime[p99], normal[p99])
+
+    def test_missing_privileges_warn(self):
+        options = RealtimeOptions(priority=100)  # out of range
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertFalse(options.apply())
+        self.assertTrue(issubclass(caught[0].category, RealtimeWarning))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import time
+import random
+import unittest
+from pifacecommon.scheduler import TimerWheel, OutputScheduler
+from .emulated import EmulatedBoards, make_chips
+
+
+TIMERS = 10000
+TICKS = 100000  # spread over 100 s of 1 ms ticks
+WHEEL_BUDGET = 2.0  # seconds to add and expire every timer
+
+
+class TimerWheelTest(unittest.TestCase):
+    def test_10k_timers(self):
+        random.seed(42)
+        wheel = TimerWheel()
+        expiries = [random.randrange(TICKS) for i in range(TIMERS)]
+        start_time = time.time()
+        for i, tick in enumerate(expiries):
+            wheel.add(tick, (tick, i))
+        add_time = time.time() - start_time
+        expired = list()
+        for tick in range(TICKS):
+            for expiry, i in wheel.advance(tick):
+                self.assertEqual(expiry, tick)
+                expired.append(expiry)
+        total_time = time.time() - start_time
+        print("%d timers: %.1f us per add, %.3f s for %d ticks" % (
+            TIMERS, add_time / TIMERS * 1e6, total_time - add_time, TICKS))
+        self.assertEqual(expired, sorted(expiries))
+        self.assertEqual(wheel.pending, 0)
+        self.assertLess(total_time, WHEEL_BUDGET)
+
+    def test_overflow_and_late_timers(self):
+        wheel = TimerWheel(levels=2)
+        wheel.add(1 << 20, 'far')  # beyond the top level
+        wheel.advance(100)
+        wheel.add(5, 'late')
+        self.assertEqual(wheel.advance(100), [])
+        self.assertEqual(wheel.advance(101), ['late'])
+        self.assertEqual(wheel.advance((1 << 20) - 1), [])
+        self.assertEqual(wheel.advance(1 << 20), ['far'])
+
+
+class OutputSchedulerTest(unittest.TestCase):
+    def test_due_changes_are_merged(self):
+        with EmulatedBoards() as boards:
+            chips = make_chips()
+            chips[0].olata.value = 0x80  # kept
+            scheduler = OutputScheduler(chips)
+            for chip in chips:
+                for pin_num in (0, 9):
+                    scheduler.set_later(0, chip, pin_num, 1)
+            scheduler.set_later(0, chips[1], 0, 0).cancel()
+            time.sleep(scheduler.tick * 2)
+            ioctls = boards.ioctls
+            self.assertEqual(scheduler.run_due(), 9)
+            # one read of the latches, one write
+            self.assertEqual(boards.ioctls - ioctls, 2)
+            values = [chip.olata.value | (chip.olatb.value << 8)
+                      for chip in chips]
+        self.assertEqual(values, [0x0281] + [0x0201] * 3)
+
+    def test_10k_pending_outputs(self):
+        random.seed(42)
+        with EmulatedBoards() as boards:
+            chips = make_chips()
+            scheduler = OutputScheduler(chips)
+            scheduler.start()
+            try:
+                start_time = time.time()
+                for i in range(TIMERS):
+                    pin_num = i // 4 % 16
+                    scheduler.set_later(random.random() * 0.5,
+                                        chips[i % 4], pin_num, pin_num % 2)
+                add_time = time.time() - start_time
+                ioctls = boards.ioctls
+                deadline = time.time() + 5
+                while scheduler.wheel.pending and time.time() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(scheduler.wheel.pending, 0)
+            finally:
+                scheduler.stop()
+            print("%d outputs: %.1f us per set_later, %d ioctls" % (
+                TIMERS, add_time / TIMERS * 1e6, boards.ioctls - ioctls))
+            # a read and a write per tick at most
+            ticks = int((add_time + 0.5) / scheduler.tick) + 2
+            self.assertLessEqual(boards.ioctls - ioctls, 2 * ticks)
+            values = [chip.olata.value | (chip.olatb.value << 8)
+                      for chip in chips]
+        # odd pins were only ever set to 1, even pins to 0
+        self.assertEqual(values, [0xAAAA] * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()